@@ -12,7 +12,6 @@ Usage:
 import argparse
 import os
 import re
-import subprocess
 import sys
 import tempfile
 from datetime import datetime
@@ -30,6 +29,49 @@ except ImportError:
     print("Error: google-genai not installed. Run: pip install google-genai")
     sys.exit(1)
 
+# The webpage-to-markdown skill ships next to this one; its converter runs in-process
+WEBPAGE_TO_MARKDOWN_SCRIPTS = Path(__file__).resolve().parent.parent.parent / "webpage-to-markdown" / "scripts"
+sys.path.insert(0, str(WEBPAGE_TO_MARKDOWN_SCRIPTS))
+try:
+    from convert_webpage import ConversionResult, convert_webpage
+except ImportError:
+    print(f"Error: webpage-to-markdown script not found at {WEBPAGE_TO_MARKDOWN_SCRIPTS}")
+    sys.exit(1)
+
+from post_variations import PostStyle, add_generation_arguments, generate_variations
+
+VARIATION_NAMES = ["Personal Reaction", "Problem-Solution", "Key Insight"]
+
+VARIATION_ANGLES = {
+    1: {
+        "angle": "Start with personal reaction/discovery. Lead with what struck you most.",
+        "guidelines": """- Start with what caught your attention personally
+- Mix practical takeaways with broader insights
+- Use first person naturally ("I found this interesting", "What caught my attention")""",
+    },
+    2: {
+        "angle": "Focus on the problem-solution angle. What problem did this solve?",
+        "guidelines": """- Lead with the problem/challenge being addressed
+- Explain the solution and why it matters
+- Use first person naturally ("I found this interesting", "What struck me")""",
+    },
+    3: {
+        "angle": "Focus on the key insight or takeaway. What's the one thing people should know?",
+        "guidelines": """- Lead with the central insight or realization
+- Explain why this insight matters
+- Connect to practical implications
+- Use first person naturally ("I realized", "This made me think")""",
+    },
+}
+
+STYLE = PostStyle(
+    VARIATION_NAMES,
+    VARIATION_ANGLES,
+    intro="You are writing LinkedIn posts about an article you just read.",
+    url_name="original URL",
+    promotion_rule="NO self-promotion or requests to follow/share/repost",
+)
+
 
 def load_api_key() -> str:
     script_dir = Path(__file__).parent.resolve()
@@ -43,27 +85,10 @@ def load_api_key() -> str:
     return os.environ.get("GOOGLE_API_KEY", "")
 
 
-def convert_webpage_to_markdown(url: str, output_dir: Path) -> Path:
-    script_path = Path(__file__).parent.parent.parent / "webpage-to-markdown" / "scripts" / "convert_webpage.py"
-
-    if not script_path.exists():
-        raise FileNotFoundError(f"webpage-to-markdown script not found at {script_path}")
-
+def convert_webpage_to_markdown(url: str, output_dir: Path, client: genai.Client) -> ConversionResult:
+    # Raises ConversionError carrying the URL, failing stage and HTTP status
     print("Converting webpage to markdown...")
-    result = subprocess.run(
-        ["python3", str(script_path), url, "--output-dir", str(output_dir)],
-        capture_output=True,
-        text=True
-    )
-
-    if result.returncode != 0:
-        raise RuntimeError(f"webpage-to-markdown failed: {result.stderr}")
-
-    article_path = output_dir / "article.md"
-    if not article_path.exists():
-        raise FileNotFoundError(f"article.md not created at {article_path}")
-
-    return article_path
+    return convert_webpage(url, output_dir, client=client)
 
 
 def analyze_article(article_content: str) -> dict:
@@ -123,164 +148,10 @@ def analyze_article(article_content: str) -> dict:
     }
 
 
-def generate_linkedin_post_variation(variation: int, article_analysis: dict, article_content: str, original_url: str, api_key: str) -> str:
-    """Generate a specific variation of the LinkedIn post."""
-
-    # Prepare article excerpt (first 3000 chars to stay within token limits)
-    article_excerpt = article_content[:3000] if len(article_content) > 3000 else article_content
-
-    # Build topic guidance
-    topic_guidance = ""
-    if article_analysis["is_technical"]:
-        topic_guidance = "This is a technical article. Maintain technical accuracy but keep it accessible to non-specialists."
-    else:
-        topic_guidance = "Focus on relatable insights and broader implications for your audience."
-
-    # Different prompts for each variation
-    variation_prompts = {
-        1: f"""You are writing a LinkedIn post about an article you just read. Write in a genuine, conversational
-tone as if you're sharing insights with professional peers over coffee.
-
-Variation 1: Start with personal reaction/discovery. Lead with what struck you most.
-
-Article Title: {article_analysis['title']}
-
-Article Content (excerpt):
-{article_excerpt}
-
-Original URL: {original_url}
-
-Topic Type: {article_analysis['topic_type']}
-{topic_guidance}
-
-Guidelines - What TO do:
-- Write in natural paragraphs (not bullet points or lists)
-- Be conversational, not corporate or dramatic
-- Start with what caught your attention personally
-- Mix practical takeaways with broader insights
-- Include specific examples/data when they add value
-- Recommended length: {article_analysis['recommended_length']}
-- End with the original URL on its own line
-- Use first person naturally ("I found this interesting", "What caught my attention")
-
-Guidelines - What NOT to do:
-- NO emojis of any kind
-- NO em-dashes (use regular dashes or write around them)
-- NO clickbait openings
-- NO dramatic one-liners for effect
-- NO "Here's why:", "Here's how:", "Here's the story:" setups
-- NO bullet points with emoji markers
-- NO self-promotion or requests to follow/share/repost
-- NO manufactured suspense or breathless tone
-- NO listicle format
-- NO ending with CTAs about sharing or following
-
-Write the LinkedIn post now (start writing directly, no preamble):""",
-
-        2: f"""You are writing a LinkedIn post about an article you just read. Write in a genuine, conversational
-tone as if you're sharing insights with professional peers over coffee.
-
-Variation 2: Focus on the problem-solution angle. What problem did this solve?
-
-Article Title: {article_analysis['title']}
-
-Article Content (excerpt):
-{article_excerpt}
-
-Original URL: {original_url}
-
-Topic Type: {article_analysis['topic_type']}
-{topic_guidance}
-
-Guidelines - What TO do:
-- Write in natural paragraphs (not bullet points or lists)
-- Be conversational, not corporate or dramatic
-- Lead with the problem/challenge being addressed
-- Explain the solution and why it matters
-- Include specific examples/data when they add value
-- Recommended length: {article_analysis['recommended_length']}
-- End with the original URL on its own line
-- Use first person naturally ("I found this interesting", "What struck me")
-
-Guidelines - What NOT to do:
-- NO emojis of any kind
-- NO em-dashes (use regular dashes or write around them)
-- NO clickbait openings
-- NO dramatic one-liners for effect
-- NO "Here's why:", "Here's how:", "Here's the story:" setups
-- NO bullet points with emoji markers
-- NO self-promotion or requests to follow/share/repost
-- NO manufactured suspense or breathless tone
-- NO listicle format
-- NO ending with CTAs about sharing or following
-
-Write the LinkedIn post now (start writing directly, no preamble):""",
-
-        3: f"""You are writing a LinkedIn post about an article you just read. Write in a genuine, conversational
-tone as if you're sharing insights with professional peers over coffee.
-
-Variation 3: Focus on the key insight or takeaway. What's the one thing people should know?
-
-Article Title: {article_analysis['title']}
-
-Article Content (excerpt):
-{article_excerpt}
-
-Original URL: {original_url}
-
-Topic Type: {article_analysis['topic_type']}
-{topic_guidance}
-
-Guidelines - What TO do:
-- Write in natural paragraphs (not bullet points or lists)
-- Be conversational, not corporate or dramatic
-- Lead with the central insight or realization
-- Explain why this insight matters
-- Connect to practical implications
-- Include specific examples/data when they add value
-- Recommended length: {article_analysis['recommended_length']}
-- End with the original URL on its own line
-- Use first person naturally ("I realized", "This made me think")
-
-Guidelines - What NOT to do:
-- NO emojis of any kind
-- NO em-dashes (use regular dashes or write around them)
-- NO clickbait openings
-- NO dramatic one-liners for effect
-- NO "Here's why:", "Here's how:", "Here's the story:" setups
-- NO bullet points with emoji markers
-- NO self-promotion or requests to follow/share/repost
-- NO manufactured suspense or breathless tone
-- NO listicle format
-- NO ending with CTAs about sharing or following
-
-Write the LinkedIn post now (start writing directly, no preamble):"""
-    }
-
-    prompt = variation_prompts[variation]
-
-    client = genai.Client(api_key=api_key)
-    response = client.models.generate_content(
-        model="gemini-2.0-flash",
-        contents=prompt
-    )
-
-    post_content = response.text.strip()
-
-    # Ensure URL is on its own line at the end
-    if original_url not in post_content:
-        post_content = f"{post_content}\n\n{original_url}"
-    elif not post_content.endswith(original_url):
-        # Remove URL if it appears elsewhere and add at end
-        post_content = post_content.replace(original_url, "").strip()
-        post_content = f"{post_content}\n\n{original_url}"
-
-    return post_content
-
-
 def main():
     parser = argparse.ArgumentParser(description="Generate LinkedIn post from webpage")
     parser.add_argument("url", help="URL of the webpage to convert")
+    add_generation_arguments(parser)
     args = parser.parse_args()
 
     api_key = load_api_key()
@@ -288,30 +159,35 @@ def main():
         print("Error: GOOGLE_API_KEY not found in .env file")
         sys.exit(1)
 
+    client = genai.Client(api_key=api_key)
+
     # Create temporary output directory
     with tempfile.TemporaryDirectory() as temp_dir:
         temp_dir_path = Path(temp_dir)
 
         try:
             # Convert webpage to markdown
-            article_path = convert_webpage_to_markdown(args.url, temp_dir_path)
-            article_content = article_path.read_text()
+            conversion = convert_webpage_to_markdown(args.url, temp_dir_path, client)
+            article_path = conversion.article_path
+            article_content = conversion.markdown
 
             # Analyze article
             article_analysis = analyze_article(article_content)
             print(f"Article analyzed: {article_analysis['word_count']} words, {article_analysis['topic_type']} topic")
 
-            # Generate three LinkedIn post variations
+            # Generate the three LinkedIn post variations in parallel
             print("Generating three LinkedIn post variations...")
-            variations = {}
-            for i in range(1, 4):
-                print(f"  Generating variation {i}...")
-                variations[f"variation_{i}"] = generate_linkedin_post_variation(i, article_analysis, article_content, args.url, api_key)
+            variations = generate_variations(
+                STYLE, article_analysis, article_content, args.url, client, args.timeout,
+                args.single_request, args.excerpt_chars, args.cache_ttl
+            )
+            if not variations:
+                raise RuntimeError("no post variation could be generated")
 
             # Save all variations to separate files
-            for i in range(1, 4):
+            for i, post in variations.items():
                 post_path = temp_dir_path / f"linkedin-post-variation-{i}.md"
-                post_path.write_text(variations[f"variation_{i}"])
+                post_path.write_text(post)
 
             # Also copy article.md to output
             article_output = temp_dir_path / "article.md"
@@ -332,18 +208,17 @@ def main():
                     shutil.copytree(file, output_dir / file.name, dirs_exist_ok=True)
 
             # Print all variations to stdout
-            for i in range(1, 4):
+            for i, post in variations.items():
                 print("\n" + "="*80)
-                print(f"VARIATION {i}: {['Personal Reaction', 'Problem-Solution', 'Key Insight'][i-1]}")
+                print(f"VARIATION {i}: {VARIATION_NAMES[i - 1]}")
                 print("="*80)
-                print(variations[f"variation_{i}"])
+                print(post)
 
             print("\n" + "="*80)
             print(f"All variations saved to: {output_dir}")
             print(f"Files:")
-            print(f"  - linkedin-post-variation-1.md (Personal Reaction)")
-            print(f"  - linkedin-post-variation-2.md (Problem-Solution)")
-            print(f"  - linkedin-post-variation-3.md (Key Insight)")
+            for i in variations:
+                print(f"  - linkedin-post-variation-{i}.md ({VARIATION_NAMES[i - 1]})")
             print(f"  - article.md (Original article)")
             print(f"  - assets/ (Images)")
             print("="*80)
@@ -0,0 +1,349 @@
+#!/usr/bin/env python3
+"""
+Prompt assembly and Gemini generation for the LinkedIn post generator.
+
+The generator describes its variations with a PostStyle (angle names, angle
+guidelines and prompt wording); building the shared prompt prefix, context
+caching, single-request and per-variation generation, and cost logging live here.
+webpage-to-markdown's scripts directory must be on sys.path.
+
+linkedin-post-generator ships an identical copy so each skill installs on its own;
+change both together.
+"""
+
+import argparse
+import hashlib
+import json
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+
+from google import genai
+from google.genai import types
+
+from convert_webpage import GEMINI_MODEL, generate_content
+
+DEFAULT_VARIATION_TIMEOUT = 90
+# gemini-2.0-flash list prices in USD per million tokens, used to log an estimated cost per run
+INPUT_PRICE_PER_MTOK = 0.10
+OUTPUT_PRICE_PER_MTOK = 0.40
+CACHED_INPUT_PRICE_PER_MTOK = 0.025
+DEFAULT_EXCERPT_CHARS = 3000
+# Explicit context caching only accepts prompts of at least this many tokens on gemini-2.0-flash
+CACHE_MIN_TOKENS = 4096
+DEFAULT_CACHE_TTL = 3600
+
+VARIATIONS_RESPONSE_SCHEMA = types.Schema(
+    type="ARRAY",
+    items=types.Schema(
+        type="OBJECT",
+        properties={
+            "variation": types.Schema(type="INTEGER"),
+            "post": types.Schema(type="STRING"),
+        },
+        required=["variation", "post"],
+    ),
+)
+
+
+def build_topic_guidance(article_analysis: dict) -> str:
+    if article_analysis["is_technical"]:
+        return "This is a technical article. Maintain technical accuracy but keep it accessible to non-specialists."
+    return "Focus on relatable insights and broader implications for your audience."
+
+
+class PostStyle:
+    """The variation angles and prompt wording of one post generator."""
+
+    def __init__(self, names: list[str], angles: dict[int, dict], intro: str, url_name: str, promotion_rule: str):
+        self.names = names
+        self.angles = angles
+        self.intro = intro
+        self.url_name = url_name
+        self.promotion_rule = promotion_rule
+
+    def name(self, variation: int) -> str:
+        return self.names[variation - 1]
+
+    def prefix(
+        self,
+        article_analysis: dict,
+        article_content: str,
+        original_url: str,
+        excerpt_chars: int = DEFAULT_EXCERPT_CHARS,
+    ) -> str:
+        """The article excerpt and guidelines common to every variation, identical across requests so it can be cached."""
+        article_excerpt = article_content[:excerpt_chars]
+        url_label = self.url_name[0].upper() + self.url_name[1:]
+
+        return f"""{self.intro} Write in a genuine, conversational
+tone as if you're sharing insights with professional peers over coffee.
+
+Article Title: {article_analysis['title']}
+
+Article Content (excerpt):
+{article_excerpt}
+
+{url_label}: {original_url}
+
+Topic Type: {article_analysis['topic_type']}
+{build_topic_guidance(article_analysis)}
+
+Guidelines for every post - What TO do:
+- Write in natural paragraphs (not bullet points or lists)
+- Be conversational, not corporate or dramatic
+- Include specific examples/data when they add value
+- Recommended length: {article_analysis['recommended_length']}
+- End with the {self.url_name} on its own line
+
+Guidelines - What NOT to do:
+- NO emojis of any kind
+- NO em-dashes (use regular dashes or write around them)
+- NO clickbait openings
+- NO dramatic one-liners for effect
+- NO "Here's why:", "Here's how:", "Here's the story:" setups
+- NO bullet points with emoji markers
+- {self.promotion_rule}
+- NO manufactured suspense or breathless tone
+- NO listicle format
+- NO ending with CTAs about sharing or following"""
+
+    def variation_suffix(self, variation: int) -> str:
+        """The part of a single-variation prompt that follows the shared prefix."""
+        spec = self.angles[variation]
+        return f"""Variation {variation}: {spec['angle']}
+
+Guidelines for this post:
+{spec['guidelines']}
+
+Write the LinkedIn post now (start writing directly, no preamble):"""
+
+    def combined_suffix(self) -> str:
+        """The part of the all-variations prompt that follows the shared prefix."""
+        angles = "\n\n".join(
+            f"Variation {i} ({self.name(i)}): {spec['angle']}\n{spec['guidelines']}"
+            for i, spec in self.angles.items()
+        )
+
+        return f"""Write {len(self.angles)} different posts about the same article, one for each variation below.
+
+Variations (each post follows only its own angle and bullets):
+
+{angles}
+
+Return a JSON array with one object per post containing its "variation" number and the full "post" text."""
+
+
+class GenerationStats:
+    """Requests, tokens and wall time spent generating posts, logged to compare generation modes."""
+
+    def __init__(self, mode: str):
+        self.mode = mode
+        self.calls = 0
+        self.input_tokens = 0
+        self.cached_tokens = 0
+        self.output_tokens = 0
+        self.started = time.perf_counter()
+        self.lock = threading.Lock()
+
+    def add(self, response) -> None:
+        usage = getattr(response, "usage_metadata", None)
+        with self.lock:
+            self.calls += 1
+            if usage:
+                self.input_tokens += usage.prompt_token_count or 0
+                self.cached_tokens += getattr(usage, "cached_content_token_count", None) or 0
+                self.output_tokens += usage.candidates_token_count or 0
+
+    def report(self) -> str:
+        cost = ((self.input_tokens - self.cached_tokens) * INPUT_PRICE_PER_MTOK
+                + self.cached_tokens * CACHED_INPUT_PRICE_PER_MTOK
+                + self.output_tokens * OUTPUT_PRICE_PER_MTOK) / 1_000_000
+        requests = f"{self.calls} request{'' if self.calls == 1 else 's'}"
+        return (f"Generation ({self.mode}): {requests} in {time.perf_counter() - self.started:.2f}s, "
+                f"{self.input_tokens} input ({self.cached_tokens} cached) + {self.output_tokens} output tokens, "
+                f"~${cost:.5f}")
+
+
+def finalize_post(post_content: str, original_url: str) -> str:
+    """Ensure the URL is on its own line at the end."""
+    post_content = post_content.strip()
+    if original_url not in post_content:
+        return f"{post_content}\n\n{original_url}"
+    if not post_content.endswith(original_url):
+        post_content = post_content.replace(original_url, "").strip()
+        return f"{post_content}\n\n{original_url}"
+    return post_content
+
+
+def open_prefix_cache(client: genai.Client, prefix: str, ttl: int = DEFAULT_CACHE_TTL) -> str | None:
+    """Name of a Gemini context cache holding the prefix, or None when it should be sent inline.
+
+    The cache is named after a hash of the model and prefix, so another run for
+    the same article finds and reuses it until its TTL expires.
+    """
+    if ttl <= 0 or len(prefix) // 4 < CACHE_MIN_TOKENS:
+        return None
+
+    display_name = "linkedin-post-" + hashlib.sha256(f"{GEMINI_MODEL}:{prefix}".encode()).hexdigest()[:16]
+    try:
+        for cache in client.caches.list():
+            if cache.display_name == display_name:
+                print(f"Reusing cached prompt prefix {cache.name}")
+                return cache.name
+
+        cache = client.caches.create(
+            model=GEMINI_MODEL,
+            config=types.CreateCachedContentConfig(contents=[prefix], display_name=display_name, ttl=f"{ttl}s"),
+        )
+        print(f"Cached prompt prefix as {cache.name} for {ttl}s")
+        return cache.name
+    except Exception as e:
+        print(f"  Warning: Context caching unavailable, sending the prompt prefix inline: {e}")
+        return None
+
+
+def generate_with_prefix(
+    client: genai.Client,
+    prefix: str,
+    suffix: str,
+    cache_name: str | None,
+    timeout: float,
+    stats: GenerationStats | None = None,
+    **config,
+):
+    """Send prefix + suffix, reading the prefix from the context cache when there is one."""
+    # Paced by the converter's shared Gemini limiter; the deadline bounds queueing, retries and the request
+    deadline_at = time.monotonic() + timeout
+    response = None
+    if cache_name:
+        try:
+            response = generate_content(
+                client,
+                deadline_at,
+                model=GEMINI_MODEL,
+                contents=suffix,
+                config=types.GenerateContentConfig(cached_content=cache_name, **config)
+            )
+        except Exception as e:
+            # The cache may have expired or been deleted since it was looked up
+            print(f"  Warning: Cached request failed, resending the prompt prefix inline: {e}")
+
+    if response is None:
+        response = generate_content(
+            client,
+            deadline_at,
+            model=GEMINI_MODEL,
+            contents=f"{prefix}\n\n{suffix}",
+            config=types.GenerateContentConfig(**config) if config else None
+        )
+
+    if stats:
+        stats.add(response)
+    return response
+
+
+def generate_variation(
+    style: PostStyle,
+    variation: int,
+    prefix: str,
+    original_url: str,
+    client: genai.Client,
+    timeout: float = DEFAULT_VARIATION_TIMEOUT,
+    stats: GenerationStats | None = None,
+    cache_name: str | None = None,
+) -> str:
+    """Generate a specific variation of the LinkedIn post."""
+    response = generate_with_prefix(client, prefix, style.variation_suffix(variation), cache_name, timeout, stats)
+    return finalize_post(response.text, original_url)
+
+
+def generate_all_variations(
+    style: PostStyle,
+    prefix: str,
+    original_url: str,
+    client: genai.Client,
+    timeout: float = DEFAULT_VARIATION_TIMEOUT,
+    stats: GenerationStats | None = None,
+    cache_name: str | None = None,
+) -> dict[int, str]:
+    """Generate every variation in one structured request; variations missing from the reply are left out."""
+    response = generate_with_prefix(
+        client, prefix, style.combined_suffix(), cache_name, timeout, stats,
+        response_mime_type="application/json",
+        response_schema=VARIATIONS_RESPONSE_SCHEMA,
+    )
+
+    variations = {}
+    for item in json.loads(response.text):
+        variation = item.get("variation")
+        post = str(item.get("post", "")).strip()
+        if variation in style.angles and post and variation not in variations:
+            variations[variation] = finalize_post(post, original_url)
+    return variations
+
+
+def generate_variations(
+    style: PostStyle,
+    article_analysis: dict,
+    article_content: str,
+    original_url: str,
+    client: genai.Client,
+    timeout: float = DEFAULT_VARIATION_TIMEOUT,
+    single_request: bool = False,
+    excerpt_chars: int = DEFAULT_EXCERPT_CHARS,
+    cache_ttl: int = DEFAULT_CACHE_TTL,
+) -> dict[int, str]:
+    """Generate all variations; returns {variation number: post} in variation order for those that succeeded.
+
+    Every prompt starts with the same shared prefix, which is put in a Gemini
+    context cache when it is long enough. With single_request, one structured
+    request asks for every variation and only the ones missing from its reply
+    are generated individually.
+    """
+    prefix = style.prefix(article_analysis, article_content, original_url, excerpt_chars)
+    cache_name = open_prefix_cache(client, prefix, cache_ttl)
+
+    stats = GenerationStats("single request" if single_request else "one request per variation")
+    variations = {}
+    if single_request:
+        try:
+            variations = generate_all_variations(style, prefix, original_url, client, timeout, stats, cache_name)
+        except Exception as e:
+            print(f"  Warning: Single-request generation failed, falling back to one request per variation: {e}")
+
+    missing = [i for i in style.angles if i not in variations]
+    if single_request and missing:
+        stats.mode = "single request with per-variation fallback"
+        print(f"  Generating variations {', '.join(map(str, missing))} individually")
+
+    with ThreadPoolExecutor(max_workers=max(1, len(missing))) as executor:
+        futures = {
+            i: executor.submit(
+                generate_variation, style, i, prefix, original_url, client, timeout, stats, cache_name
+            )
+            for i in missing
+        }
+
+    for i, future in futures.items():
+        try:
+            variations[i] = future.result()
+        except Exception as e:
+            print(f"  Warning: Variation {i} ({style.name(i)}) failed: {e}")
+
+    print(stats.report())
+    return dict(sorted(variations.items()))
+
+
+def add_generation_arguments(parser: argparse.ArgumentParser) -> None:
+    """The generation flags both post generators accept."""
+    parser.add_argument("--timeout", type=float, default=DEFAULT_VARIATION_TIMEOUT,
+                        help=f"Seconds allowed for each post variation (default: {DEFAULT_VARIATION_TIMEOUT})")
+    parser.add_argument("--single-request", action="store_true",
+                        help="Ask for all variations in one structured request, falling back to one request "
+                             "per variation for any the reply is missing")
+    parser.add_argument("--excerpt-chars", type=int, default=DEFAULT_EXCERPT_CHARS,
+                        help=f"Characters of the article included in the prompt (default: {DEFAULT_EXCERPT_CHARS})")
+    parser.add_argument("--cache-ttl", type=int, default=DEFAULT_CACHE_TTL,
+                        help=f"Seconds to keep the shared prompt prefix in Gemini's context cache once it reaches "
+                             f"{CACHE_MIN_TOKENS} tokens; 0 disables caching (default: {DEFAULT_CACHE_TTL})")
@@ -3,17 +3,32 @@
 Convert webpage to markdown with local images and multi-level summaries.
 
 Usage:
-    python convert_webpage.py URL [--output-dir DIR]
+    python convert_webpage.py URL [--output-dir DIR] [--engine jina|local] [--max-concurrency N]
+    python convert_webpage.py --urls-file FILE [--output-dir DIR] [--workers N]
 """
 
 import argparse
+import codecs
 import hashlib
+import json
+import math
 import mimetypes
+import multiprocessing
 import os
+import random
 import re
+import shutil
+import sqlite3
 import sys
+import tempfile
+import threading
+import time
+from contextlib import contextmanager
+from html.parser import HTMLParser
+from concurrent.futures import ProcessPoolExecutor, ThreadPoolExecutor, wait
 from datetime import datetime
 from pathlib import Path
+from urllib.parse import parse_qsl, urlencode, urljoin, urlparse, urlunparse
 
 try:
     from dotenv import load_dotenv
@@ -23,6 +38,8 @@ except ImportError:
 
 try:
     import requests
+    from requests.adapters import HTTPAdapter
+    from urllib3.util.retry import Retry
 except ImportError:
     print("Error: requests not installed. Run: pip install requests")
     sys.exit(1)
@@ -34,6 +51,16 @@ except ImportError:
     print("Error: google-genai not installed. Run: pip install google-genai")
     sys.exit(1)
 
+try:
+    from PIL import Image
+except ImportError:
+    Image = None
+
+try:
+    import numpy as np
+except ImportError:
+    np = None
+
 
 def load_api_key() -> str:
     script_dir = Path(__file__).parent.resolve()
@@ -47,60 +74,1364 @@ def load_api_key() -> str:
     return os.environ.get("GOOGLE_API_KEY", "")
 
 
-def fetch_webpage(url: str) -> str:
+# Code fences and code spans come first so the images, tags and headings shown inside them stay literal
+IMAGE_TOKEN_PATTERN = re.compile(
+    r"(?P<fence>^[ ]{0,3}(?P<fence_marker>(?P<fence_char>[`~])(?P=fence_char){2,})[^\n]*"
+    r"(?:\n[\s\S]*?)??(?:\n[ ]{0,3}(?P=fence_marker)(?P=fence_char)*[ \t]*$|\Z))"
+    r"|(?P<code>(?<!`)(?P<ticks>`+)(?!`)(?:[^\n]|\n(?![ \t]*$))+?(?<!`)(?P=ticks)(?!`))"
+    r"|(?P<inline>!\[(?P<alt>[^\]]*)\]\((?P<target>[^)]+)\))"
+    r"|(?P<refimg>!\[(?P<ref_alt>[^\]]*)\](?:\[(?P<ref>[^\]]*)\])?(?!\())"
+    r"|(?P<refdef>^[ ]{0,3}\[(?P<def_label>[^\]]+)\]:[ \t]*<?(?P<def_url>[^\s>]+)>?)"
+    r"|(?P<html><img\b[^>]*>)"
+    r"|(?P<title>^#[ \t]+(?P<title_text>.+)$)",
+    re.MULTILINE | re.IGNORECASE,
+)
+HTML_IMAGE_ATTR_PATTERN = re.compile(
+    r"(?<![\w-])(?P<name>src|srcset|data-src)\s*=\s*"
+    r"(?:\"(?P<dq>[^\"]*)\"|'(?P<sq>[^']*)'|(?P<bare>[^\s>]+))",
+    re.IGNORECASE,
+)
+SRCSET_CANDIDATE_PATTERN = re.compile(r"(\S+)(?:\s+[^,]*)?(?:,\s*|$)")
+FENCE_LINE_PATTERN = re.compile(r"[ ]{0,3}(`{3,}|~{3,})")
+GEMINI_MODEL = "gemini-2.0-flash"
+DEFAULT_MAX_CONCURRENCY = 8
+DEFAULT_ANALYSIS_CONCURRENCY = 4
+DEFAULT_ANALYSIS_BATCH_SIZE = 1
+DEFAULT_SUMMARY_CHUNK_CHARS = 15000
+DEFAULT_WEBP_QUALITY = 80
+DEFAULT_PHASH_THRESHOLD = 6
+# dHash only sees brightness steps, so images flatter than this (grey levels) all hash alike
+PHASH_MIN_STDDEV = 2.0
+DEFAULT_DECORATIVE_MAX_DIMENSION = 100
+DEFAULT_DECORATIVE_MAX_ASPECT = 8.0
+DEFAULT_DECORATIVE_MIN_BYTES = 1024
+DEFAULT_DECORATIVE_MIN_ENTROPY = 0.3
+# A matching URL only marks an image decorative if it is also small enough to be an icon, logo or button
+DEFAULT_DECORATIVE_URL_MAX_DIMENSION = 256
+DECORATIVE_URL_MAX_BYTES = 16 * 1024
+# Path segments and hosts that almost always serve trackers, icons, avatars and share buttons
+DEFAULT_DECORATIVE_URL_PATTERN = (
+    r"(?:^|[/_.-])(?:1x1|avatars?|badges?|beacon|blank|buttons?|emoji|favicons?|gravatar|icons?|logos?"
+    r"|pixel|share|social|spacer|sprites?|tracking|tracker)(?=$|[/_.?&=#\d-])"
+    r"|doubleclick\.net|google-analytics\.com|facebook\.com/tr|pixel\.wp\.com"
+)
+RESIZABLE_FORMATS = {"JPEG", "PNG", "GIF", "BMP", "TIFF", "WEBP"}
+MAX_SUMMARY_WORKERS = 16
+DEFAULT_PER_HOST_CONCURRENCY = 4
+DEFAULT_WORKERS = 4
+DEFAULT_MAX_HTTP_REQUESTS = 32
+DEFAULT_MAX_GEMINI_REQUESTS = 8
+DEFAULT_POOL_SIZE = 16
+DEFAULT_RETRIES = 3
+DEFAULT_GEMINI_RPM = 2000
+DEFAULT_GEMINI_TPM = 4_000_000
+DEFAULT_GEMINI_RETRIES = 6
+# Gemini bills an image part of up to 384px at 258 tokens; larger ones are tiled and cost more.
+# Estimates only need to be close: the bucket is corrected with reported usage after each call.
+IMAGE_TOKEN_ESTIMATE = 258
+OUTPUT_TOKEN_ESTIMATE = 400
+# With --deadline, fractions of the budget after which each stage stops waiting for stragglers
+DEADLINE_DOWNLOAD_SHARE = 0.5
+DEADLINE_ANALYSIS_SHARE = 0.8
+DEADLINE_WRITE_MARGIN = 0.5
+DEFAULT_CONNECT_TIMEOUT = 10.0
+DEFAULT_FETCH_READ_TIMEOUT = 60.0
+DEFAULT_IMAGE_READ_TIMEOUT = 30.0
+USER_AGENT = "Mozilla/5.0 (compatible; WebpageToMarkdown/1.0)"
+DEFAULT_ENGINE = "jina"
+VOID_TAGS = {"area", "base", "br", "col", "embed", "hr", "img", "input", "link", "meta", "source", "track", "wbr"}
+SKIP_TAGS = {
+    "script", "style", "noscript", "template", "svg", "canvas", "iframe", "form", "button",
+    "select", "input", "textarea", "nav", "header", "footer", "aside", "head",
+}
+BLOCK_TAGS = {
+    "address", "article", "aside", "blockquote", "body", "dd", "div", "dl", "dt", "figure",
+    "footer", "header", "html", "li", "main", "ol", "p", "pre", "section", "table", "ul",
+    "h1", "h2", "h3", "h4", "h5", "h6",
+}
+NEGATIVE_HINTS = re.compile(
+    r"comment|sidebar|footer|masthead|\bnav|menu|share|social|promo|advert|\bads?\b|related|"
+    r"cookie|subscribe|newsletter|banner|popup|modal|breadcrumb|widget|sponsor",
+    re.IGNORECASE,
+)
+POSITIVE_HINTS = re.compile(r"article|content|post|entry|main|story|body|text", re.IGNORECASE)
+DEFAULT_CACHE_DIR = Path(os.environ.get("XDG_CACHE_HOME", Path.home() / ".cache")) / "webpage-to-markdown"
+DEFAULT_IMAGE_CACHE_MB = 500
+DEFAULT_PAGE_TTL_HOURS = 24
+DEFAULT_PAGE_CACHE_ENTRIES = 1000
+DEFAULT_DESCRIPTION_TTL_DAYS = 30
+DEFAULT_DESCRIPTION_CACHE_ENTRIES = 20000
+DEFAULT_MAX_IMAGE_MB = 25
+DOWNLOAD_CHUNK_SIZE = 64 * 1024
+# Enough of the body to see past an SVG's XML declaration, comments and doctype
+SNIFF_BYTES = 1024
+IMAGE_SIGNATURES = [
+    (b"\xff\xd8\xff", ".jpg"),
+    (b"\x89PNG\r\n\x1a\n", ".png"),
+    (b"GIF87a", ".gif"),
+    (b"GIF89a", ".gif"),
+    (b"BM", ".bmp"),
+    (b"\x00\x00\x01\x00", ".ico"),
+    (b"II*\x00", ".tiff"),
+    (b"MM\x00*", ".tiff"),
+]
+SVG_PROLOGUE = re.compile(rb"(?:\s+|<\?xml.*?\?>|<!--.*?-->|<!doctype[^>\[]*(?:\[.*?\])?\s*>)*", re.DOTALL)
+FICLONE = 0x40049409
+# Read once at import: os.umask can only be queried by setting it, which is not thread-safe
+_umask = os.umask(0)
+os.umask(_umask)
+NEW_FILE_MODE = 0o666 & ~_umask
+
+
+def link_file(source: Path, dest: Path) -> None:
+    """Hardlink source to dest, falling back to a reflink and then a plain copy."""
+    tmp_path = dest.with_name(f".{dest.name}.{threading.get_ident()}.tmp")
+    try:
+        os.link(source, tmp_path)
+    except OSError:
+        try:
+            import fcntl
+            with open(source, "rb") as src, open(tmp_path, "wb") as dst:
+                fcntl.ioctl(dst.fileno(), FICLONE, src.fileno())
+        except (ImportError, OSError):
+            shutil.copyfile(source, tmp_path)
+    os.replace(tmp_path, dest)
+
+
+class DescriptionCache:
+    """Image descriptions keyed by content hash, article context and model."""
+
+    def __init__(
+        self,
+        cache_dir: Path,
+        ttl_seconds: float = DEFAULT_DESCRIPTION_TTL_DAYS * 86400,
+        max_entries: int = DEFAULT_DESCRIPTION_CACHE_ENTRIES,
+    ):
+        self.ttl_seconds = ttl_seconds
+        self.max_entries = max_entries
+        self.lock = threading.Lock()
+        self.db = connect_cache_db(cache_dir / "descriptions.db", """
+            CREATE TABLE IF NOT EXISTS descriptions (
+                content_hash TEXT NOT NULL,
+                context TEXT NOT NULL,
+                model TEXT NOT NULL,
+                description TEXT NOT NULL,
+                created_at REAL NOT NULL,
+                last_used REAL NOT NULL,
+                PRIMARY KEY (content_hash, context, model)
+            );
+        """)
+
+    def get(self, content_hash: str, context: str, model: str) -> str | None:
+        now = time.time()
+        with self.lock:
+            row = self.db.execute(
+                "SELECT description FROM descriptions "
+                "WHERE content_hash = ? AND context = ? AND model = ? AND created_at >= ?",
+                (content_hash, context, model, now - self.ttl_seconds),
+            ).fetchone()
+            if row:
+                self.db.execute(
+                    "UPDATE descriptions SET last_used = ? WHERE content_hash = ? AND context = ? AND model = ?",
+                    (now, content_hash, context, model),
+                )
+                self.db.commit()
+        return row[0] if row else None
+
+    def put(self, content_hash: str, context: str, model: str, description: str) -> None:
+        now = time.time()
+        with self.lock:
+            self.db.execute(
+                "INSERT OR REPLACE INTO descriptions VALUES (?, ?, ?, ?, ?, ?)",
+                (content_hash, context, model, description, now, now),
+            )
+            self.db.commit()
+        self.evict()
+
+    def evict(self) -> None:
+        with self.lock:
+            self.db.execute(
+                "DELETE FROM descriptions WHERE created_at < ?", (time.time() - self.ttl_seconds,)
+            )
+            self.db.execute(
+                "DELETE FROM descriptions WHERE rowid IN ("
+                "SELECT rowid FROM descriptions ORDER BY last_used DESC LIMIT -1 OFFSET ?)",
+                (self.max_entries,),
+            )
+            self.db.commit()
+
+    def close(self) -> None:
+        with self.lock:
+            self.db.close()
+
+
+def file_hash(path: Path) -> str:
+    hasher = hashlib.sha256()
+    with open(path, "rb") as f:
+        for chunk in iter(lambda: f.read(DOWNLOAD_CHUNK_SIZE), b""):
+            hasher.update(chunk)
+    return hasher.hexdigest()
+
+
+def sniff_image_type(head: bytes) -> str | None:
+    for signature, ext in IMAGE_SIGNATURES:
+        if head.startswith(signature):
+            return ext
+    if head[:4] == b"RIFF" and head[8:12] == b"WEBP":
+        return ".webp"
+    if head[4:8] == b"ftyp" and head[8:12] in (b"avif", b"avis", b"heic", b"heix", b"mif1"):
+        return ".avif" if head[8:11] == b"avi" else ".heic"
+    text = head.removeprefix(b"\xef\xbb\xbf").lower()
+    if text[SVG_PROLOGUE.match(text).end():].startswith(b"<svg"):
+        return ".svg"
+    return None
+
+
+def sniff_body(head: bytes, content_type: str) -> str | None:
+    """Image extension from the body's magic bytes, trusting an SVG Content-Type whose prologue runs past SNIFF_BYTES."""
+    return sniff_image_type(head) or (".svg" if content_type == "image/svg+xml" else None)
+
+
+def connect_cache_db(path: Path, schema: str) -> sqlite3.Connection:
+    path.parent.mkdir(parents=True, exist_ok=True)
+    db = sqlite3.connect(str(path), check_same_thread=False, timeout=30)
+    db.executescript(schema)
+    db.commit()
+    return db
+
+
+def normalize_url(url: str) -> str:
+    parsed = urlparse(url.strip())
+    scheme = parsed.scheme.lower()
+    host = (parsed.hostname or "").lower()
+    if parsed.port and (scheme, parsed.port) not in (("http", 80), ("https", 443)):
+        host = f"{host}:{parsed.port}"
+    path = parsed.path or "/"
+    query = urlencode(sorted(parse_qsl(parsed.query, keep_blank_values=True)))
+    return urlunparse((scheme, host, path, parsed.params, query, ""))
+
+
+class OfflineCacheMiss(Exception):
+    pass
+
+
+class PageCache:
+    """Fetched markdown keyed by normalized URL, valid for a fixed TTL.
+
+    Stale entries are kept for offline replay; the cache is bounded by entry
+    count, dropping the least recently fetched pages first.
+    """
+
+    def __init__(
+        self,
+        cache_dir: Path,
+        ttl_seconds: float = DEFAULT_PAGE_TTL_HOURS * 3600,
+        max_entries: int = DEFAULT_PAGE_CACHE_ENTRIES,
+    ):
+        self.ttl_seconds = ttl_seconds
+        self.max_entries = max_entries
+        self.lock = threading.Lock()
+        self.db = connect_cache_db(cache_dir / "pages.db", """
+            CREATE TABLE IF NOT EXISTS pages (
+                url TEXT PRIMARY KEY,
+                content TEXT NOT NULL,
+                fetched_at REAL NOT NULL
+            );
+        """)
+
+    @staticmethod
+    def key(url: str, engine: str) -> str:
+        # Jina entries keep the bare URL so caches from before engine selection stay valid
+        return normalize_url(url) if engine == DEFAULT_ENGINE else f"{engine}:{normalize_url(url)}"
+
+    def get(self, url: str, allow_stale: bool = False, engine: str = DEFAULT_ENGINE) -> str | None:
+        with self.lock:
+            row = self.db.execute(
+                "SELECT content, fetched_at FROM pages WHERE url = ?", (self.key(url, engine),)
+            ).fetchone()
+        if not row or (not allow_stale and time.time() - row[1] > self.ttl_seconds):
+            return None
+        return row[0]
+
+    def put(self, url: str, content: str, engine: str = DEFAULT_ENGINE) -> None:
+        with self.lock:
+            self.db.execute(
+                "INSERT OR REPLACE INTO pages (url, content, fetched_at) VALUES (?, ?, ?)",
+                (self.key(url, engine), content, time.time()),
+            )
+            self.db.execute(
+                "DELETE FROM pages WHERE rowid IN ("
+                "SELECT rowid FROM pages ORDER BY fetched_at DESC LIMIT -1 OFFSET ?)",
+                (self.max_entries,),
+            )
+            self.db.commit()
+
+    def close(self) -> None:
+        with self.lock:
+            self.db.close()
+
+
+class ImageCache:
+    """Cross-run image store keyed by URL and content hash, evicted LRU by size."""
+
+    def __init__(self, cache_dir: Path, max_bytes: int = DEFAULT_IMAGE_CACHE_MB * 1024 * 1024):
+        self.blob_dir = cache_dir / "images"
+        self.blob_dir.mkdir(parents=True, exist_ok=True)
+        self.max_bytes = max_bytes
+        self.lock = threading.Lock()
+        self.db = connect_cache_db(cache_dir / "images.db", """
+            CREATE TABLE IF NOT EXISTS urls (
+                url TEXT PRIMARY KEY,
+                filename TEXT NOT NULL,
+                etag TEXT,
+                last_modified TEXT
+            );
+            CREATE TABLE IF NOT EXISTS blobs (
+                filename TEXT PRIMARY KEY,
+                size INTEGER NOT NULL,
+                last_used REAL NOT NULL
+            );
+        """)
+        columns = {row[1] for row in self.db.execute("PRAGMA table_info(blobs)")}
+        if "dhash" not in columns:
+            self.db.execute("ALTER TABLE blobs ADD COLUMN dhash TEXT")
+            self.db.commit()
+
+    def lookup(self, url: str) -> dict | None:
+        with self.lock:
+            row = self.db.execute(
+                "SELECT filename, etag, last_modified FROM urls WHERE url = ?", (url,)
+            ).fetchone()
+        if not row or not (self.blob_dir / row[0]).exists():
+            return None
+        return {"filename": row[0], "etag": row[1], "last_modified": row[2]}
+
+    def conditional_headers(self, entry: dict) -> dict:
+        headers = {}
+        if entry.get("etag"):
+            headers["If-None-Match"] = entry["etag"]
+        if entry.get("last_modified"):
+            headers["If-Modified-Since"] = entry["last_modified"]
+        return headers
+
+    def link_into(self, filename: str, assets_dir: Path) -> None:
+        dest = assets_dir / filename
+        if not dest.exists():
+            link_file(self.blob_dir / filename, dest)
+        with self.lock:
+            self.db.execute("UPDATE blobs SET last_used = ? WHERE filename = ?", (time.time(), filename))
+            self.db.commit()
+
+    def store(self, url: str, asset_path: Path, etag: str | None, last_modified: str | None) -> None:
+        blob_path = self.blob_dir / asset_path.name
+        if not blob_path.exists():
+            link_file(asset_path, blob_path)
+        with self.lock:
+            self.db.execute(
+                "INSERT OR REPLACE INTO blobs (filename, size, last_used) VALUES (?, ?, ?)",
+                (asset_path.name, blob_path.stat().st_size, time.time()),
+            )
+            self.db.execute(
+                "INSERT OR REPLACE INTO urls (url, filename, etag, last_modified) VALUES (?, ?, ?, ?)",
+                (url, asset_path.name, etag, last_modified),
+            )
+            self.db.commit()
+        self.evict()
+
+    def set_dhash(self, filename: str, value: int) -> None:
+        with self.lock:
+            self.db.execute("UPDATE blobs SET dhash = ? WHERE filename = ?", (f"{value:016x}", filename))
+            self.db.commit()
+
+    def find_similar(self, value: int, threshold: int) -> str | None:
+        with self.lock:
+            rows = self.db.execute("SELECT filename, dhash FROM blobs WHERE dhash IS NOT NULL").fetchall()
+        rows = [row for row in rows if (self.blob_dir / row[0]).exists()]
+        if not rows:
+            return None
+        distances = hamming_distances(value, np.array([int(row[1], 16) for row in rows], dtype=np.uint64))
+        best = int(np.argmin(distances))
+        return rows[best][0] if distances[best] <= threshold else None
+
+    def evict(self) -> None:
+        with self.lock:
+            total = self.db.execute("SELECT COALESCE(SUM(size), 0) FROM blobs").fetchone()[0]
+            if total <= self.max_bytes:
+                return
+            for filename, size in self.db.execute(
+                "SELECT filename, size FROM blobs ORDER BY last_used ASC"
+            ).fetchall():
+                if total <= self.max_bytes:
+                    break
+                (self.blob_dir / filename).unlink(missing_ok=True)
+                self.db.execute("DELETE FROM blobs WHERE filename = ?", (filename,))
+                self.db.execute("DELETE FROM urls WHERE filename = ?", (filename,))
+                total -= size
+            self.db.commit()
+
+    def close(self) -> None:
+        with self.lock:
+            self.db.close()
+
+
+class Deadline:
+    """A wall-clock budget for one conversion, with a cutoff for each stage and a record of what it dropped."""
+
+    def __init__(self, seconds: float):
+        self.seconds = seconds
+        self.started = time.monotonic()
+        self.skipped = []
+        self.lock = threading.Lock()
+
+    def cutoff(self, share: float = 1.0) -> float:
+        return self.started + max(0.0, self.seconds * share - DEADLINE_WRITE_MARGIN)
+
+    def remaining(self, share: float = 1.0) -> float:
+        return max(0.0, self.cutoff(share) - time.monotonic())
+
+    def skip(self, stage: str, item: str) -> None:
+        with self.lock:
+            if (stage, item) not in self.skipped:
+                self.skipped.append((stage, item))
+
+
+class GeminiLimiter:
+    """Request and token buckets per minute plus an AIMD window on in-flight Gemini calls."""
+
+    def __init__(
+        self,
+        rpm: int = DEFAULT_GEMINI_RPM,
+        tpm: int = DEFAULT_GEMINI_TPM,
+        max_concurrency: int = DEFAULT_MAX_GEMINI_REQUESTS,
+        retries: int = DEFAULT_GEMINI_RETRIES,
+    ):
+        self.rpm = max(0, rpm)
+        self.tpm = max(0, tpm)
+        self.max_concurrency = max(1, max_concurrency)
+        self.retries = retries
+        self.window = float(self.max_concurrency)
+        self.in_flight = 0
+        self.request_budget = float(self.rpm)
+        self.token_budget = float(self.tpm)
+        self.updated = time.monotonic()
+        self.paused_until = 0.0
+        self.throttled = 0
+        self.condition = threading.Condition()
+
+    def _refill(self, now: float) -> None:
+        elapsed = now - self.updated
+        self.updated = now
+        if self.rpm:
+            self.request_budget = min(self.rpm, self.request_budget + elapsed * self.rpm / 60)
+        if self.tpm:
+            self.token_budget = min(self.tpm, self.token_budget + elapsed * self.tpm / 60)
+
+    def acquire(self, tokens: int, deadline_at: float | None = None) -> None:
+        if self.tpm:
+            tokens = min(tokens, self.tpm)
+        with self.condition:
+            while True:
+                now = time.monotonic()
+                if deadline_at is not None and now >= deadline_at:
+                    raise TimeoutError("deadline reached before the Gemini request could start")
+                self._refill(now)
+                if self.in_flight >= int(self.window):
+                    wait = None
+                else:
+                    wait = max(0.0, self.paused_until - now)
+                    if self.rpm and self.request_budget < 1:
+                        wait = max(wait, (1 - self.request_budget) * 60 / self.rpm)
+                    if self.tpm and self.token_budget < tokens:
+                        wait = max(wait, (tokens - self.token_budget) * 60 / self.tpm)
+                    if wait == 0:
+                        self.in_flight += 1
+                        self.request_budget -= 1
+                        self.token_budget -= tokens
+                        return
+                if deadline_at is not None:
+                    wait = min(wait if wait is not None else deadline_at - now, deadline_at - now)
+                self.condition.wait(wait)
+
+    def release(self, estimated: int, used: int | None, throttled_for: float | None = None) -> None:
+        with self.condition:
+            self.in_flight -= 1
+            if used is not None and self.tpm:
+                # Settle the estimate against reported usage; a negative budget is a debt to wait out
+                self.token_budget -= used - min(estimated, self.tpm)
+            if throttled_for is not None:
+                # Multiplicative decrease, and hold every caller back until the server's delay passes
+                self.throttled += 1
+                self.window = max(1.0, self.window / 2)
+                self.paused_until = max(self.paused_until, time.monotonic() + throttled_for)
+            else:
+                # Additive increase: about one extra slot per window's worth of successful calls
+                self.window = min(self.max_concurrency, self.window + 1 / self.window)
+            self.condition.notify_all()
+
+    def call(self, request, estimated_tokens: int, deadline_at: float | None = None):
+        for attempt in range(self.retries + 1):
+            self.acquire(estimated_tokens, deadline_at)
+            try:
+                response = request()
+            except Exception as e:
+                if getattr(e, "code", None) not in (429, 503) or attempt == self.retries:
+                    self.release(estimated_tokens, None)
+                    raise
+                delay = retry_delay(e, attempt)
+                self.release(estimated_tokens, None, throttled_for=delay)
+                print(f"Gemini rate limited ({e.code}), retrying in {delay:.1f}s "
+                      f"with up to {int(self.window)} concurrent requests")
+                continue
+            usage = getattr(response, "usage_metadata", None)
+            self.release(estimated_tokens, usage.total_token_count if usage else None)
+            return response
+
+
+def retry_delay(error: Exception, attempt: int) -> float:
+    # 429 replies carry a RetryInfo detail such as 'retryDelay': '17s'
+    match = re.search(r"retryDelay['\"]?\s*:\s*['\"](\d+(?:\.\d+)?)s", str(error))
+    if match:
+        return float(match.group(1))
+    return min(60.0, 2 ** attempt) * random.uniform(0.5, 1.0)
+
+
+def estimate_tokens(contents) -> int:
+    parts = contents if isinstance(contents, list) else [contents]
+    tokens = OUTPUT_TOKEN_ESTIMATE
+    for part in parts:
+        tokens += len(part) // 4 if isinstance(part, str) else IMAGE_TOKEN_ESTIMATE
+    return tokens
+
+
+# Process-wide limits on requests, shared by every article in a batch and every Gemini call site
+http_slots = threading.BoundedSemaphore(DEFAULT_MAX_HTTP_REQUESTS)
+gemini_limiter = GeminiLimiter()
+
+
+def set_request_limits(
+    max_http: int,
+    max_gemini: int,
+    gemini_rpm: int = DEFAULT_GEMINI_RPM,
+    gemini_tpm: int = DEFAULT_GEMINI_TPM,
+) -> None:
+    global http_slots, gemini_limiter
+    http_slots = threading.BoundedSemaphore(max(1, max_http))
+    gemini_limiter = GeminiLimiter(gemini_rpm, gemini_tpm, max_gemini)
+
+
+def with_deadline(request: dict, deadline_at: float | None) -> dict:
+    """Give a request an HTTP timeout that ends at deadline_at (a time.monotonic() value)."""
+    if deadline_at is None:
+        return request
+    timeout_ms = max(1, int((deadline_at - time.monotonic()) * 1000))
+    config = request.get("config") or types.GenerateContentConfig()
+    return {**request, "config": config.model_copy(update={"http_options": types.HttpOptions(timeout=timeout_ms)})}
+
+
+def generate_content(client: genai.Client, deadline_at: float | None = None, **request):
+    """client.models.generate_content paced by the shared limiter, retrying 429/503 replies."""
+    return gemini_limiter.call(
+        lambda: client.models.generate_content(**with_deadline(request, deadline_at)),
+        estimate_tokens(request["contents"]),
+        deadline_at,
+    )
+
+
+class StreamedResponse:
+    """The text and final usage of a streamed generation."""
+
+    def __init__(self, text: str, usage_metadata):
+        self.text = text
+        self.usage_metadata = usage_metadata
+
+
+def generate_content_stream(
+    client: genai.Client, on_text, deadline_at: float | None = None, **request
+) -> StreamedResponse:
+    """Stream a generation through the shared limiter, passing each text chunk to on_text."""
+    def consume():
+        parts = []
+        usage = None
+        try:
+            for chunk in client.models.generate_content_stream(**with_deadline(request, deadline_at)):
+                if deadline_at is not None and time.monotonic() > deadline_at:
+                    raise TimeoutError("deadline reached while the reply was streaming")
+                usage = getattr(chunk, "usage_metadata", None) or usage
+                if chunk.text:
+                    parts.append(chunk.text)
+                    on_text(chunk.text)
+        except Exception as e:
+            if not parts:
+                raise
+            # Text already went out, so a retry would duplicate it
+            raise RuntimeError(f"stream interrupted after {len(parts)} chunks: {e}") from e
+        return StreamedResponse("".join(parts), usage)
+
+    return gemini_limiter.call(consume, estimate_tokens(request["contents"]), deadline_at)
+
+
+class Profiler:
+    """Records timed spans with bytes and token counts for the --profile report."""
+
+    def __init__(self):
+        self.origin = time.perf_counter()
+        self.events = []
+        self.lock = threading.Lock()
+
+    @contextmanager
+    def span(self, name: str, category: str, **args):
+        record = dict(args)
+        started = time.perf_counter()
+        try:
+            yield record
+        except BaseException as e:
+            record["error"] = str(e)[:200]
+            raise
+        finally:
+            duration = time.perf_counter() - started
+            with self.lock:
+                self.events.append({
+                    "name": name,
+                    "category": category,
+                    "start_s": round(started - self.origin, 6),
+                    "duration_s": round(duration, 6),
+                    "thread": threading.get_ident(),
+                    "args": record,
+                })
+
+    def summary(self) -> dict:
+        stages = {}
+        for event in self.events:
+            stage = stages.setdefault(event["name"], {
+                "count": 0, "total_s": 0.0, "max_s": 0.0, "bytes": 0,
+                "prompt_tokens": 0, "output_tokens": 0, "errors": 0,
+            })
+            stage["count"] += 1
+            stage["total_s"] = round(stage["total_s"] + event["duration_s"], 6)
+            stage["max_s"] = max(stage["max_s"], event["duration_s"])
+            stage["bytes"] += event["args"].get("bytes", 0)
+            stage["prompt_tokens"] += event["args"].get("prompt_tokens", 0)
+            stage["output_tokens"] += event["args"].get("output_tokens", 0)
+            stage["errors"] += "error" in event["args"]
+        return stages
+
+    def write(self, directory: Path) -> tuple[Path, Path]:
+        with self.lock:
+            events = sorted(self.events, key=lambda event: event["start_s"])
+        report_path = directory / "profile.json"
+        report_path.write_text(json.dumps({
+            "wall_s": round(time.perf_counter() - self.origin, 6),
+            "stages": self.summary(),
+            "events": events,
+        }, indent=2))
+
+        threads = {thread: index for index, thread in enumerate(dict.fromkeys(e["thread"] for e in events))}
+        trace_path = directory / "trace.json"
+        trace_path.write_text(json.dumps({"traceEvents": [
+            {
+                "name": event["name"],
+                "cat": event["category"],
+                "ph": "X",
+                "ts": round(event["start_s"] * 1e6),
+                "dur": round(event["duration_s"] * 1e6),
+                "pid": os.getpid(),
+                "tid": threads[event["thread"]],
+                "args": event["args"],
+            }
+            for event in events
+        ]}))
+        return report_path, trace_path
+
+
+active_profiler = None
+
+
+def set_profiler(profiler: Profiler | None) -> None:
+    global active_profiler
+    active_profiler = profiler
+
+
+@contextmanager
+def profile_span(name: str, category: str, **args):
+    if active_profiler is None:
+        yield {}
+    else:
+        with active_profiler.span(name, category, **args) as record:
+            yield record
+
+
+def record_usage(record: dict, response) -> None:
+    usage = getattr(response, "usage_metadata", None)
+    if usage:
+        record["prompt_tokens"] = usage.prompt_token_count or 0
+        record["output_tokens"] = usage.candidates_token_count or 0
+
+
+def create_session(pool_size: int = DEFAULT_POOL_SIZE, retries: int = DEFAULT_RETRIES) -> requests.Session:
+    retry = Retry(
+        total=retries,
+        backoff_factor=0.5,
+        status_forcelist=(429, 503),
+        allowed_methods=("GET", "HEAD"),
+        respect_retry_after_header=True,
+        raise_on_status=False,
+    )
+    adapter = HTTPAdapter(pool_connections=pool_size, pool_maxsize=pool_size, max_retries=retry)
+
+    session = requests.Session()
+    session.mount("http://", adapter)
+    session.mount("https://", adapter)
+    session.headers.update({"User-Agent": USER_AGENT})
+    return session
+
+
+def without_retries(session: requests.Session) -> requests.Session:
+    """A view of session that never retries, sharing its connection pools, headers and cookies.
+
+    The view must not be closed: that would close the pools it shares with session.
+    """
+    view = requests.Session()
+    for name in ("headers", "cookies", "auth", "proxies", "hooks", "params", "verify", "cert", "trust_env"):
+        setattr(view, name, getattr(session, name))
+    for prefix, adapter in session.adapters.items():
+        if isinstance(adapter, HTTPAdapter):
+            shared = adapter
+            adapter = HTTPAdapter(max_retries=0)
+            adapter.poolmanager = shared.poolmanager
+            adapter.proxy_manager = shared.proxy_manager
+        view.mount(prefix, adapter)
+    return view
+
+
+class HTMLNode:
+    def __init__(self, tag: str, attrs: list | None = None, parent: "HTMLNode | None" = None):
+        self.tag = tag
+        self.attrs = {name: value or "" for name, value in attrs or []}
+        self.parent = parent
+        self.children = []
+
+    def iter(self, tag: str | None = None):
+        for child in self.children:
+            if isinstance(child, HTMLNode):
+                if tag is None or child.tag == tag:
+                    yield child
+                yield from child.iter(tag)
+
+    def text_content(self) -> str:
+        return "".join(child if isinstance(child, str) else child.text_content() for child in self.children)
+
+
+class DOMBuilder(HTMLParser):
+    """Builds a forgiving HTMLNode tree, closing implicitly ended <p> and <li> elements."""
+
+    def __init__(self):
+        super().__init__(convert_charrefs=True)
+        self.root = HTMLNode("#root")
+        self.current = self.root
+
+    def handle_starttag(self, tag, attrs):
+        if self.current.tag == "p" and tag in BLOCK_TAGS:
+            self.current = self.current.parent
+        if tag == "li":
+            node = self.current
+            while node is not self.root and node.tag not in ("ul", "ol"):
+                if node.tag == "li":
+                    self.current = node.parent
+                    break
+                node = node.parent
+        node = HTMLNode(tag, attrs, self.current)
+        self.current.children.append(node)
+        if tag not in VOID_TAGS:
+            self.current = node
+
+    def handle_endtag(self, tag):
+        node = self.current
+        while node is not self.root and node.tag != tag:
+            node = node.parent
+        if node is not self.root:
+            self.current = node.parent
+
+    def handle_data(self, data):
+        self.current.children.append(data)
+
+
+def prune_boilerplate(node: HTMLNode) -> None:
+    kept = []
+    for child in node.children:
+        if isinstance(child, HTMLNode):
+            hints = f"{child.attrs.get('class', '')} {child.attrs.get('id', '')} {child.attrs.get('role', '')}"
+            hidden = (
+                "hidden" in child.attrs
+                or child.attrs.get("aria-hidden") == "true"
+                or re.search(r"display\s*:\s*none", child.attrs.get("style", ""))
+            )
+            if child.tag in SKIP_TAGS or hidden:
+                continue
+            if child.tag not in ("html", "body", "article", "main") and NEGATIVE_HINTS.search(hints) \
+                    and not POSITIVE_HINTS.search(hints):
+                continue
+            prune_boilerplate(child)
+        kept.append(child)
+    node.children = kept
+
+
+def link_density(node: HTMLNode) -> float:
+    text_length = len(node.text_content().strip()) or 1
+    link_length = sum(len(link.text_content().strip()) for link in node.iter("a"))
+    return link_length / text_length
+
+
+def find_main_content(root: HTMLNode) -> HTMLNode:
+    """Pick the element holding the article body, Readability style."""
+    landmarks = [
+        node for node in root.iter()
+        if node.tag in ("article", "main") or node.attrs.get("role") == "main"
+    ]
+    landmarks = [node for node in landmarks if len(node.text_content().strip()) >= 500]
+    if landmarks:
+        return max(landmarks, key=lambda node: len(node.text_content()))
+
+    scores = {}
+    nodes = {}
+    for paragraph in list(root.iter("p")) + list(root.iter("pre")):
+        text = paragraph.text_content().strip()
+        if len(text) < 25 or paragraph.parent is None:
+            continue
+        score = 1 + text.count(",") + min(len(text) // 100, 3)
+        for ancestor, weight in ((paragraph.parent, 1.0), (paragraph.parent.parent, 0.5)):
+            if ancestor is None or ancestor is root:
+                continue
+            scores[id(ancestor)] = scores.get(id(ancestor), 0) + score * weight
+            nodes[id(ancestor)] = ancestor
+
+    if not scores:
+        return next(root.iter("body"), root)
+    best = max(scores, key=lambda key: scores[key] * (1 - link_density(nodes[key])))
+    return nodes[best]
+
+
+def render_inline(node: HTMLNode, base_url: str) -> str:
+    return "".join(render_markdown(child, base_url) for child in node.children)
+
+
+def render_markdown(node, base_url: str) -> str:
+    if isinstance(node, str):
+        return re.sub(r"\s+", " ", node)
+
+    tag = node.tag
+    if tag in ("h1", "h2", "h3", "h4", "h5", "h6"):
+        text = render_inline(node, base_url).strip()
+        return f"\n\n{'#' * int(tag[1])} {text}\n\n" if text else ""
+    if tag == "br":
+        return "\n"
+    if tag == "hr":
+        return "\n\n---\n\n"
+    if tag in ("strong", "b"):
+        text = render_inline(node, base_url).strip()
+        return f"**{text}**" if text else ""
+    if tag in ("em", "i"):
+        text = render_inline(node, base_url).strip()
+        return f"*{text}*" if text else ""
+    if tag == "code":
+        text = node.text_content().strip()
+        return f"`{text}`" if text else ""
+    if tag == "pre":
+        code = next(node.iter("code"), None)
+        language = re.search(r"(?:language|lang)-(\S+)", (code or node).attrs.get("class", ""))
+        text = node.text_content().strip("\n")
+        return f"\n\n```{language.group(1) if language else ''}\n{text}\n```\n\n"
+    if tag == "a":
+        text = render_inline(node, base_url).strip()
+        href = node.attrs.get("href", "")
+        if not href or href.startswith(("#", "javascript:")):
+            return text
+        return f"[{text}]({urljoin(base_url, href)})" if text else ""
+    if tag == "img":
+        # Lazy-loaded images keep a data: placeholder in src and the real URL elsewhere
+        src = node.attrs.get("src", "")
+        if not src or src.startswith("data:"):
+            srcset = node.attrs.get("srcset", "")
+            spans = srcset_urls(srcset)
+            src = node.attrs.get("data-src") or (srcset[spans[-1][0]:spans[-1][1]] if spans else "")
+        if not src:
+            return ""
+        alt = node.attrs.get("alt", "").replace("[", "").replace("]", "")
+        return f"![{alt}]({urljoin(base_url, src)})"
+    if tag in ("ul", "ol"):
+        items = []
+        for index, item in enumerate((child for child in node.children
+                                      if isinstance(child, HTMLNode) and child.tag == "li"), 1):
+            marker = f"{index}." if tag == "ol" else "-"
+            text = re.sub(r"\n{3,}", "\n\n", render_inline(item, base_url)).strip()
+            if text:
+                items.append(f"{marker} " + text.replace("\n", "\n" + " " * (len(marker) + 1)))
+        return "\n\n" + "\n".join(items) + "\n\n" if items else ""
+    if tag == "blockquote":
+        text = re.sub(r"\n{3,}", "\n\n", render_inline(node, base_url)).strip()
+        return "\n\n" + "\n".join(f"> {line}".rstrip() for line in text.splitlines()) + "\n\n"
+    if tag == "figcaption":
+        text = render_inline(node, base_url).strip()
+        return f"\n\n*{text}*\n\n" if text else ""
+    if tag == "table":
+        rows = []
+        for row in node.iter("tr"):
+            cells = [
+                render_inline(cell, base_url).strip().replace("|", "\\|").replace("\n", " ")
+                for cell in row.children if isinstance(cell, HTMLNode) and cell.tag in ("td", "th")
+            ]
+            if cells:
+                rows.append(cells)
+        if not rows:
+            return ""
+        width = max(len(row) for row in rows)
+        lines = ["| " + " | ".join(row + [""] * (width - len(row))) + " |" for row in rows]
+        lines.insert(1, "|" + " --- |" * width)
+        return "\n\n" + "\n".join(lines) + "\n\n"
+    if tag in BLOCK_TAGS:
+        return f"\n\n{render_inline(node, base_url).strip()}\n\n"
+    return render_inline(node, base_url)
+
+
+def html_to_markdown(html: str, base_url: str) -> str:
+    builder = DOMBuilder()
+    builder.feed(html)
+    builder.close()
+    root = builder.root
+
+    base = next(root.iter("base"), None)
+    if base is not None and base.attrs.get("href"):
+        base_url = urljoin(base_url, base.attrs["href"])
+
+    title = ""
+    for meta in root.iter("meta"):
+        if meta.attrs.get("property") == "og:title" and meta.attrs.get("content"):
+            title = meta.attrs["content"].strip()
+            break
+    if not title:
+        title_node = next(root.iter("title"), None) or next(root.iter("h1"), None)
+        title = re.sub(r"\s+", " ", title_node.text_content()).strip() if title_node else ""
+
+    prune_boilerplate(root)
+    body = render_markdown(find_main_content(root), base_url)
+    lines = []
+    in_fence = False
+    for line in body.splitlines():
+        if line.startswith("```"):
+            in_fence = not in_fence
+        # Whitespace between block elements leaves a single stray leading space
+        lines.append(line if in_fence else re.sub(r"^ (?=\S)", "", line.rstrip()))
+    body = "\n".join(lines)
+    body = re.sub(r"\n{3,}", "\n\n", body).strip()
+
+    # Drop a leading H1 that only repeats the title
+    first_line = body.split("\n", 1)[0]
+    if title and first_line.lstrip("# ").strip() == title and first_line.startswith("# "):
+        body = body[len(first_line):].lstrip()
+
+    return f"# {title}\n\n{body}\n" if title else f"{body}\n"
+
+
+def fetch_via_jina(url: str, session: requests.Session, timeout: tuple[float, float], on_line=None) -> str:
+    """Stream the Reader response, calling on_line with each complete line as it arrives."""
     jina_url = f"https://r.jina.ai/{url}"
     print("Fetching webpage via Jina Reader...")
 
-    response = requests.get(jina_url, timeout=60, headers={
-        "User-Agent": "Mozilla/5.0 (compatible; WebpageToMarkdown/1.0)"
-    })
-    response.raise_for_status()
+    with profile_span("fetch", "http", url=url, engine="jina") as record:
+        with http_slots, session.get(jina_url, timeout=timeout, stream=True) as response:
+            response.raise_for_status()
+            # Jina serves UTF-8; requests would assume ISO-8859-1 for text/plain without a charset
+            charset = response.encoding if "charset" in response.headers.get("Content-Type", "").lower() else "utf-8"
+            decoder = codecs.getincrementaldecoder(charset)(errors="replace")
+            parts = []
+            pending = ""
+            received = 0
+            # chunk_size=None yields data as it arrives instead of waiting to fill a buffer
+            for chunk in response.iter_content(chunk_size=None):
+                received += len(chunk)
+                text = decoder.decode(chunk)
+                parts.append(text)
+                if on_line:
+                    *lines, pending = (pending + text).split("\n")
+                    for line in lines:
+                        on_line(line)
+            tail = decoder.decode(b"", final=True)
+            parts.append(tail)
+            if on_line and pending + tail:
+                on_line(pending + tail)
+        record["bytes"] = received
+    return "".join(parts)
 
-    print(f"Fetched {len(response.text)} characters")
-    return response.text
 
+def fetch_via_local(url: str, session: requests.Session, timeout: tuple[float, float], on_line=None) -> str:
+    # Extraction needs the whole DOM, so there is nothing to hand to on_line early
+    print("Fetching webpage and extracting content locally...")
+
+    with profile_span("fetch", "http", url=url, engine="local") as record:
+        with http_slots:
+            response = session.get(url, timeout=timeout)
+        response.raise_for_status()
+        record["bytes"] = len(response.content)
+
+    # requests assumes ISO-8859-1 for text/html without a charset; prefer the page's own declaration
+    if "charset" not in response.headers.get("Content-Type", "").lower():
+        declared = re.search(rb"<meta[^>]+charset=[\"']?([\w-]+)", response.content[:4096], re.IGNORECASE)
+        response.encoding = declared.group(1).decode() if declared else "utf-8"
+
+    with profile_span("extract", "cpu", url=url):
+        return html_to_markdown(response.text, response.url)
+
+
+EXTRACTORS = {
+    "jina": fetch_via_jina,
+    "local": fetch_via_local,
+}
+
+
+def fetch_webpage(
+    url: str,
+    session: requests.Session | None = None,
+    timeout: tuple[float, float] = (DEFAULT_CONNECT_TIMEOUT, DEFAULT_FETCH_READ_TIMEOUT),
+    cache: PageCache | None = None,
+    refresh: bool = False,
+    offline: bool = False,
+    engine: str = DEFAULT_ENGINE,
+    on_line=None,
+) -> str:
+    if cache and (offline or not refresh):
+        with profile_span("fetch_cache", "cache", url=url) as record:
+            cached = cache.get(url, allow_stale=offline, engine=engine)
+            record["hit"] = cached is not None
+        if cached is not None:
+            print(f"Loaded {len(cached)} characters from page cache")
+            return cached
+    if offline:
+        raise OfflineCacheMiss(f"{url} is not in the page cache (offline mode)")
+
+    session = session or create_session()
+    markdown = EXTRACTORS[engine](url, session, timeout, on_line)
+
+    print(f"Fetched {len(markdown)} characters")
+    if cache:
+        cache.put(url, markdown, engine=engine)
+    return markdown
 
-def download_image(url: str, assets_dir: Path) -> str | None:
+
+def download_image(
+    url: str,
+    assets_dir: Path,
+    session: requests.Session | None = None,
+    timeout: tuple[float, float] = (DEFAULT_CONNECT_TIMEOUT, DEFAULT_IMAGE_READ_TIMEOUT),
+    cache: ImageCache | None = None,
+    max_bytes: int = DEFAULT_MAX_IMAGE_MB * 1024 * 1024,
+    cancel: threading.Event | None = None,
+) -> str | None:
     if url.startswith("data:"):
         return None
 
+    session = session or create_session()
     try:
-        response = requests.get(url, timeout=30, headers={
-            "User-Agent": "Mozilla/5.0 (compatible; WebpageToMarkdown/1.0)"
-        })
-        response.raise_for_status()
+        with profile_span("download", "http", url=url) as record:
+            cached = cache.lookup(url) if cache else None
+            headers = cache.conditional_headers(cached) if cached else {}
+
+            with session.get(url, timeout=timeout, headers=headers, stream=True) as response:
+                response.raise_for_status()
+
+                record["status"] = response.status_code
+                if cached and response.status_code == 304:
+                    cache.link_into(cached["filename"], assets_dir)
+                    print(f"Cached: {cached['filename']}")
+                    return f"assets/{cached['filename']}"
+
+                content_type = response.headers.get("Content-Type", "image/jpeg").split(";")[0].strip().lower()
+                if not content_type.startswith("image/") and content_type != "application/octet-stream":
+                    raise ValueError(f"not an image (Content-Type: {content_type})")
+
+                content_length = int(response.headers.get("Content-Length") or 0)
+                if content_length > max_bytes:
+                    raise ValueError(f"image too large ({content_length} bytes > {max_bytes})")
+
+                hasher = hashlib.md5()
+                size = 0
+                head = b""
+                fd, tmp_name = tempfile.mkstemp(dir=assets_dir, prefix=".download-", suffix=".tmp")
+                tmp_path = Path(tmp_name)
+                try:
+                    with os.fdopen(fd, "wb") as tmp_file:
+                        for chunk in response.iter_content(DOWNLOAD_CHUNK_SIZE):
+                            if cancel and cancel.is_set():
+                                raise TimeoutError("cancelled at the deadline")
+                            # Check magic bytes as soon as enough of the body has arrived
+                            if len(head) < SNIFF_BYTES:
+                                head += chunk[:SNIFF_BYTES - len(head)]
+                                if len(head) == SNIFF_BYTES and not sniff_body(head, content_type):
+                                    raise ValueError("response body is not a recognised image format")
+                            size += len(chunk)
+                            if size > max_bytes:
+                                raise ValueError(f"image exceeds {max_bytes} bytes")
+                            hasher.update(chunk)
+                            tmp_file.write(chunk)
+                            record["bytes"] = size
 
-        content_hash = hashlib.md5(response.content).hexdigest()[:12]
-        content_type = response.headers.get("Content-Type", "image/jpeg").split(";")[0]
-        ext = mimetypes.guess_extension(content_type) or ".jpg"
-        if ext == ".jpe":
-            ext = ".jpg"
+                    sniffed_ext = sniff_body(head, content_type)
+                    if not sniffed_ext:
+                        raise ValueError("response body is not a recognised image format")
 
-        filename = f"{content_hash}{ext}"
-        filepath = assets_dir / filename
+                    content_hash = hasher.hexdigest()[:12]
+                    ext = mimetypes.guess_extension(content_type) if content_type.startswith("image/") else None
+                    ext = ext or sniffed_ext
+                    if ext == ".jpe":
+                        ext = ".jpg"
 
-        if not filepath.exists():
-            filepath.write_bytes(response.content)
-            print(f"Downloaded: {filename}")
+                    filename = f"{content_hash}{ext}"
+                    filepath = assets_dir / filename
 
-        return f"assets/{filename}"
+                    if cancel and cancel.is_set():
+                        # The article has already been written without this image
+                        raise TimeoutError("cancelled at the deadline")
+                    if filepath.exists():
+                        tmp_path.unlink()
+                    else:
+                        # mkstemp creates 0600 files; give assets the usual permissions for published folders
+                        os.chmod(tmp_path, NEW_FILE_MODE)
+                        os.replace(tmp_path, filepath)
+                        print(f"Downloaded: {filename}")
+                except BaseException:
+                    tmp_path.unlink(missing_ok=True)
+                    raise
+
+            if cache:
+                cache.store(url, filepath, response.headers.get("ETag"), response.headers.get("Last-Modified"))
+
+            return f"assets/{filename}"
     except Exception as e:
         print(f"Warning: Failed to download {url[:60]}...: {e}")
         return None
 
 
-def analyze_image(image_path: Path, client: genai.Client, context: str) -> str:
+def image_fingerprint(path: Path, hash_size: int = 8) -> tuple[int | None, int]:
+    """Return the dHash of an image and its pixel area.
+
+    The hash is None if the image cannot be decoded (area 0) or is too flat
+    for its hash to tell it apart from other flat images.
+    """
+    try:
+        with Image.open(path) as image:
+            area = image.size[0] * image.size[1]
+            image.draft("L", (hash_size * 8, hash_size * 8))
+            pixels = np.asarray(
+                image.convert("L").resize((hash_size + 1, hash_size), Image.LANCZOS), dtype=np.int16
+            )
+    except Exception:
+        return None, 0
+    if pixels.std() < PHASH_MIN_STDDEV:
+        return None, area
+    bits = (pixels[:, 1:] > pixels[:, :-1]).flatten()
+    return int.from_bytes(np.packbits(bits).tobytes(), "big"), area
+
+
+def hamming_distances(value: int, others: "np.ndarray") -> "np.ndarray":
+    xor = np.bitwise_xor(others, np.uint64(value))
+    return np.unpackbits(xor.view(np.uint8).reshape(-1, 8), axis=1).sum(axis=1)
+
+
+def collapse_near_duplicates(
+    local_paths: dict[str, str],
+    assets_dir: Path,
+    threshold: int = DEFAULT_PHASH_THRESHOLD,
+    cache: ImageCache | None = None,
+) -> dict[str, str]:
+    """Map URLs whose images are perceptually near-identical onto one asset.
+
+    Each group keeps its highest-resolution member. With a cache, a group
+    that matches an image from an earlier run reuses that cached blob so its
+    stored description applies too.
+    """
+    assets = list(dict.fromkeys(local_paths.values()))
+    with ThreadPoolExecutor(max_workers=DEFAULT_MAX_CONCURRENCY) as executor:
+        fingerprints = list(executor.map(lambda path: image_fingerprint(assets_dir.parent / path), assets))
+
+    groups = []
+    anchors = []
+    for asset, (value, area) in zip(assets, fingerprints):
+        if value is None:
+            groups.append([(asset, value, area)])
+            continue
+        if anchors:
+            distances = hamming_distances(value, np.array([anchor for anchor, _ in anchors], dtype=np.uint64))
+            best = int(np.argmin(distances))
+            if distances[best] <= threshold:
+                groups[anchors[best][1]].append((asset, value, area))
+                continue
+        anchors.append((value, len(groups)))
+        groups.append([(asset, value, area)])
+
+    replacements = {}
+    for group in groups:
+        keep, value, _ = max(group, key=lambda member: member[2])
+        if value is not None and cache:
+            similar = cache.find_similar(value, threshold)
+            if similar and f"assets/{similar}" != keep:
+                cache.link_into(similar, assets_dir)
+                keep = f"assets/{similar}"
+            for asset, asset_value, _ in group:
+                if asset_value is not None:
+                    cache.set_dhash(Path(asset).name, asset_value)
+        for asset, _, _ in group:
+            replacements[asset] = keep
+
+    for asset, keep in replacements.items():
+        if asset != keep and asset not in replacements.values():
+            (assets_dir.parent / asset).unlink(missing_ok=True)
+
+    collapsed = len(assets) - len(set(replacements.values()))
+    if collapsed:
+        print(f"Collapsed {collapsed} near-duplicate images")
+    return {url: replacements[path] for url, path in local_paths.items()}
+
+
+def decorative_reason(
+    urls: list[str],
+    path: Path,
+    max_dimension: int = DEFAULT_DECORATIVE_MAX_DIMENSION,
+    max_aspect: float = DEFAULT_DECORATIVE_MAX_ASPECT,
+    min_bytes: int = DEFAULT_DECORATIVE_MIN_BYTES,
+    min_entropy: float = DEFAULT_DECORATIVE_MIN_ENTROPY,
+    url_pattern: re.Pattern | None = None,
+    url_max_dimension: int = DEFAULT_DECORATIVE_URL_MAX_DIMENSION,
+) -> str | None:
+    """Return why an image looks decorative (not worth describing), or None if it should be analyzed.
+
+    urls are every URL that resolved to this image; the URL test only applies when all of them match,
+    and only to images no larger than url_max_dimension (or DECORATIVE_URL_MAX_BYTES when Pillow cannot
+    read the dimensions), so a chart or photo whose file name mentions a button or logo is still described.
+    """
+    url_match = bool(url_pattern) and all(
+        url_pattern.search(urlparse(url).netloc + urlparse(url).path) for url in urls
+    )
+    size_bytes = path.stat().st_size
+    if size_bytes < min_bytes:
+        return "bytes"
+    try:
+        with Image.open(path) as image:
+            width, height = image.size
+            if max(width, height) <= max_dimension:
+                return "size"
+            if url_match and max(width, height) <= url_max_dimension:
+                return "url"
+            if max(width, height) / max(1, min(width, height)) >= max_aspect:
+                return "aspect"
+            image.draft("L", (64, 64))
+            histogram = image.convert("L").resize((64, 64)).histogram()
+    except Exception:
+        return "url" if url_match and size_bytes <= DECORATIVE_URL_MAX_BYTES else None
+
+    # Spacers, solid fills and blank placeholders carry almost no tonal information
+    total = sum(histogram)
+    entropy = -sum(count / total * math.log2(count / total) for count in histogram if count)
+    return "flat" if entropy < min_entropy else None
+
+
+def prepare_image(
+    asset_path: str,
+    analysis_dir: str | None,
+    analysis_max_dimension: int,
+    transcode_webp: bool,
+    asset_max_dimension: int,
+    webp_quality: int,
+    originals_dir: str | None,
+) -> tuple[str, str]:
+    """Optionally re-encode an asset to WebP and write a downscaled copy for analysis.
+
+    Runs in a worker process. Returns the (possibly new) asset path and the
+    path whose bytes should be sent to Gemini.
+    """
+    asset = Path(asset_path)
+    analysis_path = asset
+    try:
+        with Image.open(asset) as image:
+            if image.format not in RESIZABLE_FORMATS or getattr(image, "is_animated", False):
+                return str(asset), str(asset)
+            image.load()
+    except Exception:
+        return str(asset), str(asset)
+
+    if transcode_webp and image.format != "WEBP":
+        webp_image = image.copy()
+        if asset_max_dimension:
+            webp_image.thumbnail((asset_max_dimension, asset_max_dimension))
+        webp_path = asset.with_suffix(".webp")
+        tmp_path = webp_path.with_name(f".{webp_path.name}.{os.getpid()}.tmp")
+        webp_image.save(tmp_path, format="WEBP", quality=webp_quality)
+        if tmp_path.stat().st_size < asset.stat().st_size:
+            os.replace(tmp_path, webp_path)
+            if originals_dir:
+                Path(originals_dir).mkdir(exist_ok=True)
+                os.replace(asset, Path(originals_dir) / asset.name)
+            else:
+                asset.unlink()
+            asset = webp_path
+            analysis_path = webp_path
+        else:
+            tmp_path.unlink()
+
+    if analysis_dir and analysis_max_dimension and max(image.size) > analysis_max_dimension:
+        preview = image.copy()
+        preview.thumbnail((analysis_max_dimension, analysis_max_dimension))
+        if preview.mode in ("RGBA", "LA", "P"):
+            analysis_path = Path(analysis_dir) / f"{asset.stem}.png"
+            preview.save(analysis_path, format="PNG", optimize=True)
+        else:
+            analysis_path = Path(analysis_dir) / f"{asset.stem}.jpg"
+            preview.convert("RGB").save(analysis_path, format="JPEG", quality=85)
+
+    return str(asset), str(analysis_path)
+
+
+def prepare_images(
+    asset_paths: list[Path],
+    analysis_dir: Path | None,
+    analysis_max_dimension: int = 0,
+    transcode_webp: bool = False,
+    asset_max_dimension: int = 0,
+    webp_quality: int = DEFAULT_WEBP_QUALITY,
+    keep_originals: bool = False,
+    max_workers: int | None = None,
+) -> list[tuple[Path, Path]]:
+    if not asset_paths or not (analysis_max_dimension or transcode_webp):
+        return [(path, path) for path in asset_paths]
+
+    originals_dir = str(asset_paths[0].parent / "originals") if keep_originals else None
+    # Download, summary and batch threads are running by now, and a forked child could
+    # inherit a lock one of them holds (stdout, SQLite), so workers start fresh interpreters
+    with profile_span("prepare_images", "cpu", images=len(asset_paths)), \
+            ProcessPoolExecutor(max_workers=max_workers, mp_context=multiprocessing.get_context("spawn")) as executor:
+        futures = [
+            executor.submit(
+                prepare_image, str(path), str(analysis_dir) if analysis_dir else None,
+                analysis_max_dimension, transcode_webp, asset_max_dimension, webp_quality, originals_dir,
+            )
+            for path in asset_paths
+        ]
+        return [(Path(asset), Path(analysis)) for asset, analysis in (f.result() for f in futures)]
+
+
+def analyze_image(image_path: Path, client: genai.Client, context: str, deadline_at: float | None = None) -> str:
     try:
         image_bytes = image_path.read_bytes()
         media_type = mimetypes.guess_type(str(image_path))[0] or "image/jpeg"
 
-        response = client.models.generate_content(
-            model="gemini-2.0-flash",
-            contents=[
-                types.Part.from_bytes(data=image_bytes, mime_type=media_type),
-                f"Describe this image concisely (1-2 sentences) in the context of an article about: {context[:200]}"
-            ]
-        )
+        with profile_span("analyze_image", "gemini", image=image_path.name, bytes=len(image_bytes)) as record:
+            response = generate_content(
+                client,
+                deadline_at,
+                model=GEMINI_MODEL,
+                contents=[
+                    types.Part.from_bytes(data=image_bytes, mime_type=media_type),
+                    f"Describe this image concisely (1-2 sentences) in the context of an article about: {context[:200]}"
+                ]
+            )
+            record_usage(record, response)
 
         return response.text
     except Exception as e:
@@ -108,44 +1439,508 @@ def analyze_image(image_path: Path, client: genai.Client, context: str) -> str:
         return ""
 
 
-def process_markdown_images(markdown: str, assets_dir: Path, client: genai.Client | None) -> str:
-    title_match = re.search(r"^#\s+(.+)$", markdown, re.MULTILINE)
-    context = title_match.group(1) if title_match else "this article"
+BATCH_RESPONSE_SCHEMA = types.Schema(
+    type="ARRAY",
+    items=types.Schema(
+        type="OBJECT",
+        properties={
+            "index": types.Schema(type="INTEGER"),
+            "description": types.Schema(type="STRING"),
+        },
+        required=["index", "description"],
+    ),
+)
+
+
+def analyze_image_batch(
+    image_paths: list[Path], client: genai.Client, context: str, deadline_at: float | None = None
+) -> list[str]:
+    """Describe several images in one request; images missing from the reply get ""."""
+    contents = []
+    for index, image_path in enumerate(image_paths, 1):
+        media_type = mimetypes.guess_type(str(image_path))[0] or "image/jpeg"
+        contents.append(f"Image {index}:")
+        contents.append(types.Part.from_bytes(data=image_path.read_bytes(), mime_type=media_type))
+    contents.append(
+        f"Describe each of the {len(image_paths)} images above concisely (1-2 sentences each) "
+        f"in the context of an article about: {context[:200]}. "
+        "Return a JSON array with one object per image containing its 1-based \"index\" and \"description\"."
+    )
+
+    upload_bytes = sum(len(part.inline_data.data) for part in contents if not isinstance(part, str))
+    with profile_span("analyze_image_batch", "gemini", images=len(image_paths), bytes=upload_bytes) as record:
+        response = generate_content(
+            client,
+            deadline_at,
+            model=GEMINI_MODEL,
+            contents=contents,
+            config=types.GenerateContentConfig(
+                response_mime_type="application/json",
+                response_schema=BATCH_RESPONSE_SCHEMA,
+            ),
+        )
+        record_usage(record, response)
+
+    descriptions = [""] * len(image_paths)
+    for item in json.loads(response.text):
+        index = item.get("index")
+        if isinstance(index, int) and 1 <= index <= len(image_paths):
+            descriptions[index - 1] = str(item.get("description", "")).strip()
+    return descriptions
+
 
-    pattern = r"!\[([^\]]*)\]\(([^)]+)\)"
-    processed_urls = {}
+def analyze_images(
+    image_paths: list[Path],
+    client: genai.Client,
+    context: str,
+    batch_size: int = DEFAULT_ANALYSIS_BATCH_SIZE,
+    max_concurrency: int = DEFAULT_ANALYSIS_CONCURRENCY,
+    cache: DescriptionCache | None = None,
+    deadline: Deadline | None = None,
+) -> list[str | None]:
+    """Describe images in order; any still outstanding at the deadline's analysis cutoff get None."""
+    if not image_paths:
+        return []
 
-    def replace_image(match):
-        alt_text = match.group(1)
-        url = match.group(2)
+    # Only the first 200 characters of context reach the prompt, so key on those
+    cache_context = context[:200]
+    descriptions = [""] * len(image_paths)
+    hashes = [file_hash(path) for path in image_paths] if cache else []
+    pending = []
+    for index, path in enumerate(image_paths):
+        cached = cache.get(hashes[index], cache_context, GEMINI_MODEL) if cache else None
+        if cached is not None:
+            descriptions[index] = cached
+        else:
+            pending.append(index)
+
+    if cache and len(pending) < len(image_paths):
+        print(f"Reused {len(image_paths) - len(pending)} cached image descriptions")
 
-        if url.startswith(".") or url.startswith("assets/"):
-            return match.group(0)
+    pending_paths = [image_paths[index] for index in pending]
+    deadline_at = deadline.cutoff(DEADLINE_ANALYSIS_SHARE) if deadline else None
 
-        if url in processed_urls:
-            local_path, description = processed_urls[url]
+    def analyze_batch(batch):
+        if len(batch) == 1:
+            return [analyze_image(batch[0], client, context, deadline_at)]
+        try:
+            batch_descriptions = analyze_image_batch(batch, client, context, deadline_at)
+        except Exception as e:
+            print(f"Warning: Batch analysis of {len(batch)} images failed, retrying individually: {e}")
+            batch_descriptions = [""] * len(batch)
+        # Fall back to single-image requests for anything the batch reply left out
+        return [
+            description or analyze_image(path, client, context, deadline_at)
+            for path, description in zip(batch, batch_descriptions)
+        ]
+
+    size = max(1, batch_size)
+    batches = [pending_paths[i:i + size] for i in range(0, len(pending_paths), size)]
+    executor = ThreadPoolExecutor(max_workers=max(1, max_concurrency))
+    futures = [executor.submit(analyze_batch, batch) for batch in batches]
+    late = wait(futures, timeout=deadline.remaining(DEADLINE_ANALYSIS_SHARE))[1] if deadline else set()
+    # Calls still running carry an HTTP timeout ending at the cutoff, so nothing needs joining;
+    # without a deadline every queued batch must run, so nothing may be cancelled
+    executor.shutdown(wait=not late, cancel_futures=bool(late))
+    analyzed = []
+    for batch, future in zip(batches, futures):
+        if future in late:
+            analyzed.extend([None] * len(batch))
         else:
-            local_path = download_image(url, assets_dir)
-            if not local_path:
-                return match.group(0)
+            analyzed.extend(future.result())
 
-            full_path = assets_dir.parent / local_path
-            description = analyze_image(full_path, client, context) if client else ""
-            processed_urls[url] = (local_path, description)
+    for index, description in zip(pending, analyzed):
+        descriptions[index] = description
+        if cache and description:
+            cache.put(hashes[index], cache_context, GEMINI_MODEL, description)
 
-        if description:
-            return f"![{alt_text}]({local_path})\n\n*{description}*\n"
-        return f"![{alt_text}]({local_path})\n"
+    return descriptions
 
-    return re.sub(pattern, replace_image, markdown)
 
+def is_local_image(url: str) -> bool:
+    return url.startswith(".") or url.startswith("assets/")
 
-def generate_summary(article_content: str, client: genai.Client) -> str:
-    print("Generating summaries...")
 
-    prompt = f"""Analyze this article and create a Summary section with three subsections.
+class ImageDownloadPool:
+    """Downloads images on a bounded thread pool as soon as their URLs are submitted."""
+
+    def __init__(
+        self,
+        assets_dir: Path,
+        max_concurrency: int = DEFAULT_MAX_CONCURRENCY,
+        per_host_concurrency: int = DEFAULT_PER_HOST_CONCURRENCY,
+        session: requests.Session | None = None,
+        timeout: tuple[float, float] = (DEFAULT_CONNECT_TIMEOUT, DEFAULT_IMAGE_READ_TIMEOUT),
+        cache: ImageCache | None = None,
+        max_bytes: int = DEFAULT_MAX_IMAGE_MB * 1024 * 1024,
+        deadline: Deadline | None = None,
+    ):
+        self.assets_dir = assets_dir
+        self.per_host_concurrency = max(1, per_host_concurrency)
+        # Retries (and Retry-After sleeps) could run far past a deadline in a thread nobody waits for
+        self.own_session = session is None
+        if self.own_session:
+            self.session = create_session(max(max_concurrency, 1), **({"retries": 0} if deadline else {}))
+        else:
+            self.session = without_retries(session) if deadline else session
+        self.timeout = timeout
+        self.cache = cache
+        self.max_bytes = max_bytes
+        self.executor = ThreadPoolExecutor(max_workers=max(1, max_concurrency))
+        self.futures = {}
+        self.host_limits = {}
+        self.lock = threading.Lock()
+        self.deadline = deadline
+        self.cancel = threading.Event()
+
+    def submit(self, url: str) -> None:
+        if is_local_image(url) or url.startswith("data:"):
+            return
+        with self.lock:
+            if url in self.futures:
+                return
+            host = urlparse(url).netloc
+            if host not in self.host_limits:
+                self.host_limits[host] = threading.Semaphore(self.per_host_concurrency)
+            self.futures[url] = self.executor.submit(self._fetch, url, self.host_limits[host])
+
+    def _fetch(self, url: str, host_limit: threading.Semaphore) -> str | None:
+        with host_limit, http_slots:
+            timeout = self.timeout
+            if self.deadline:
+                if self.cancel.is_set():
+                    return None
+                # No single read may outlast the download stage
+                remaining = max(0.1, self.deadline.remaining(DEADLINE_DOWNLOAD_SHARE))
+                timeout = (min(timeout[0], remaining), min(timeout[1], remaining))
+            return download_image(
+                url, self.assets_dir, self.session, timeout, self.cache, self.max_bytes, self.cancel
+            )
+
+    def results(self) -> dict[str, str]:
+        with self.lock:
+            futures = dict(self.futures)
+        if self.deadline:
+            _, late = wait(futures.values(), timeout=self.deadline.remaining(DEADLINE_DOWNLOAD_SHARE))
+            if late:
+                # Stragglers keep their remote URLs; in-flight ones stop at their next chunk
+                self.cancel.set()
+                for url, future in futures.items():
+                    if future in late:
+                        future.cancel()
+                        self.deadline.skip("download", url)
+                futures = {url: future for url, future in futures.items() if future not in late}
+        local_paths = {url: future.result() for url, future in futures.items()}
+        return {url: path for url, path in local_paths.items() if path}
+
+    def close(self) -> None:
+        self.executor.shutdown(wait=not self.cancel.is_set(), cancel_futures=True)
+        if self.own_session:
+            self.session.close()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc_info):
+        self.close()
+
+
+def srcset_urls(srcset: str) -> list[tuple[int, int]]:
+    """Return the (start, end) span of each candidate URL in a srcset value."""
+    spans = []
+    for match in SRCSET_CANDIDATE_PATTERN.finditer(srcset):
+        start, end = match.span(1)
+        while end > start and srcset[end - 1] == ",":
+            end -= 1
+        if end > start:
+            spans.append((start, end))
+    return spans
+
+
+def html_image_urls(tag: str) -> tuple[list[str], str | None]:
+    """Return every image URL in an <img> tag and the one that should be described."""
+    urls = []
+    primary = None
+    for match in HTML_IMAGE_ATTR_PATTERN.finditer(tag):
+        name = match.group("name").lower()
+        value = next(group for group in (match.group("dq"), match.group("sq"), match.group("bare")) if group is not None)
+        if name == "srcset":
+            candidates = [value[start:end] for start, end in srcset_urls(value)]
+            urls.extend(candidates)
+            if candidates and primary is None:
+                primary = candidates[-1]
+        elif value:
+            urls.append(value)
+            if not value.startswith("data:"):
+                primary = value
+    return urls, primary
+
+
+def rewrite_html_image(tag: str, local_paths: dict[str, str]) -> str:
+    def replace_attr(match):
+        group = next(name for name in ("dq", "sq", "bare") if match.group(name) is not None)
+        value = match.group(group)
+        if match.group("name").lower() == "srcset":
+            parts = []
+            position = 0
+            for start, end in srcset_urls(value):
+                parts.append(value[position:start])
+                parts.append(local_paths.get(value[start:end], value[start:end]))
+                position = end
+            parts.append(value[position:])
+            new_value = "".join(parts)
+        else:
+            new_value = local_paths.get(value, value)
+        value_start, value_end = match.span(group)
+        offset = match.start()
+        text = match.group(0)
+        return text[:value_start - offset] + new_value + text[value_end - offset:]
+
+    return HTML_IMAGE_ATTR_PATTERN.sub(replace_attr, tag)
+
+
+def scan_markdown_images(markdown: str, on_url=None) -> tuple[str, list, dict[str, str], list[str]]:
+    """Tokenize image references in one pass over the document.
+
+    Returns the article title, the image tokens in document order, reference
+    definitions used by images, and the URLs to describe in document order.
+    on_url is called with each downloadable URL as soon as it is discovered.
+    """
+    title = None
+    tokens = []
+    definitions = {}
+    image_labels = set()
+
+    def discover(url):
+        if url and not is_local_image(url) and not url.startswith("data:") and on_url:
+            on_url(url)
 
-Write each summary as a concise paragraph (2-4 sentences):
+    for match in IMAGE_TOKEN_PATTERN.finditer(markdown):
+        kind = match.lastgroup
+        if kind == "title":
+            if title is None:
+                title = match.group("title_text").strip()
+        elif kind == "inline":
+            target = match.group("target").strip()
+            url = target.split()[0].strip("<>") if target else ""
+            discover(url)
+            tokens.append((match.start(), match.end(), kind, match.group("alt"), url))
+        elif kind == "refimg":
+            # Definitions may come before or after the image that uses them
+            label = (match.group("ref") or match.group("ref_alt")).strip().lower()
+            image_labels.add(label)
+            if label in definitions:
+                discover(definitions[label])
+            tokens.append((match.start(), match.end(), kind, match.group(0), label))
+        elif kind == "refdef":
+            label = match.group("def_label").strip().lower()
+            definitions.setdefault(label, match.group("def_url"))
+            if label in image_labels:
+                discover(definitions[label])
+            tokens.append((match.start("def_url"), match.end("def_url"), kind, match.group("def_url"), label))
+        elif kind == "html":
+            urls, primary = html_image_urls(match.group(0))
+            for url in urls:
+                discover(url)
+            tokens.append((match.start(), match.end(), kind, match.group(0), primary))
+
+    image_definitions = {label: url for label, url in definitions.items() if label in image_labels}
+    described = []
+    for _, _, kind, _, key in tokens:
+        if kind == "refimg":
+            described.append(image_definitions.get(key))
+        elif kind != "refdef":
+            described.append(key)
+
+    return title or "this article", tokens, image_definitions, described
+
+
+def reusable_images(previous_images: dict | None, assets_dir: Path) -> dict:
+    return {
+        url: record for url, record in (previous_images or {}).items()
+        if (assets_dir.parent / record["path"]).exists()
+    }
+
+
+def process_markdown_images(
+    markdown: str,
+    assets_dir: Path,
+    client: genai.Client | None,
+    max_concurrency: int = DEFAULT_MAX_CONCURRENCY,
+    per_host_concurrency: int = DEFAULT_PER_HOST_CONCURRENCY,
+    session: requests.Session | None = None,
+    timeout: tuple[float, float] = (DEFAULT_CONNECT_TIMEOUT, DEFAULT_IMAGE_READ_TIMEOUT),
+    cache: ImageCache | None = None,
+    max_bytes: int = DEFAULT_MAX_IMAGE_MB * 1024 * 1024,
+    analysis_batch_size: int = DEFAULT_ANALYSIS_BATCH_SIZE,
+    analysis_concurrency: int = DEFAULT_ANALYSIS_CONCURRENCY,
+    description_cache: DescriptionCache | None = None,
+    analysis_max_dimension: int = 0,
+    transcode_webp: bool = False,
+    asset_max_dimension: int = 0,
+    webp_quality: int = DEFAULT_WEBP_QUALITY,
+    keep_originals: bool = False,
+    near_duplicates: str = "off",
+    phash_threshold: int = DEFAULT_PHASH_THRESHOLD,
+    skip_decorative: bool = False,
+    decorative_max_dimension: int = DEFAULT_DECORATIVE_MAX_DIMENSION,
+    decorative_max_aspect: float = DEFAULT_DECORATIVE_MAX_ASPECT,
+    decorative_min_bytes: int = DEFAULT_DECORATIVE_MIN_BYTES,
+    decorative_min_entropy: float = DEFAULT_DECORATIVE_MIN_ENTROPY,
+    decorative_url_pattern: str = DEFAULT_DECORATIVE_URL_PATTERN,
+    decorative_url_max_dimension: int = DEFAULT_DECORATIVE_URL_MAX_DIMENSION,
+    previous_images: dict | None = None,
+    image_records: dict | None = None,
+    pool: ImageDownloadPool | None = None,
+    deadline: Deadline | None = None,
+) -> str:
+    """Localize and describe every image in the markdown.
+
+    previous_images maps URLs from an earlier conversion of the same output
+    directory to their {"path", "description"}; those whose asset still exists
+    are reused without downloading, and analyzed again only if their recorded
+    description is empty and a client is given. If image_records is given it
+    is filled with the same shape for every localized URL. A caller-owned pool
+    may already hold downloads started during the fetch; it is left open.
+    """
+    reusable = reusable_images(previous_images, assets_dir)
+    reused = {}
+
+    own_pool = pool is None
+    if own_pool:
+        pool = ImageDownloadPool(
+            assets_dir, max_concurrency, per_host_concurrency, session, timeout, cache, max_bytes, deadline
+        )
+    try:
+        def submit(url):
+            if url in reusable:
+                reused[url] = reusable[url]
+            else:
+                pool.submit(url)
+
+        # Downloads start while the rest of the document is still being scanned
+        context, tokens, definitions, described = scan_markdown_images(markdown, submit)
+        local_paths = pool.results()
+    finally:
+        if own_pool:
+            pool.close()
+
+    # An empty description means analysis failed, was cut by the deadline or had no key last time
+    redescribe = {url: record["path"] for url, record in reused.items() if not record["description"]} if client else {}
+    if reused:
+        again = f" ({len(set(redescribe.values()))} to describe again)" if redescribe else ""
+        print(f"Reused {len(reused)} images from the previous conversion{again}")
+
+    if near_duplicates != "off" and local_paths:
+        with profile_span("dedupe_images", "cpu", images=len(local_paths)):
+            local_paths = collapse_near_duplicates(
+                local_paths, assets_dir, phash_threshold, cache if near_duplicates == "global" else None
+            )
+
+    # Each distinct asset is described once, even when several URLs share its bytes
+    asset_urls = {}
+    for url in described:
+        path = local_paths.get(url) or redescribe.get(url)
+        if path:
+            asset_urls.setdefault(path, []).append(url)
+    unique_paths = list(asset_urls)
+
+    if skip_decorative and client and unique_paths:
+        pattern = re.compile(decorative_url_pattern, re.IGNORECASE) if decorative_url_pattern else None
+        with profile_span("classify_images", "cpu", images=len(unique_paths)), \
+                ThreadPoolExecutor(max_workers=DEFAULT_MAX_CONCURRENCY) as executor:
+            reasons = list(executor.map(
+                lambda path: decorative_reason(
+                    asset_urls[path], assets_dir.parent / path, decorative_max_dimension,
+                    decorative_max_aspect, decorative_min_bytes, decorative_min_entropy, pattern,
+                    decorative_url_max_dimension,
+                ),
+                unique_paths,
+            ))
+        skipped = [reason for reason in reasons if reason]
+        if skipped:
+            counts = ", ".join(f"{skipped.count(reason)} {reason}" for reason in dict.fromkeys(skipped))
+            print(f"Skipping analysis of {len(skipped)} decorative images ({counts})")
+        unique_paths = [path for path, reason in zip(unique_paths, reasons) if not reason]
+    assets = list(dict.fromkeys(local_paths.values()))
+    descriptions = {record["path"]: record["description"] for record in reused.values()}
+    with tempfile.TemporaryDirectory() as analysis_dir:
+        prepared = prepare_images(
+            [assets_dir.parent / path for path in assets],
+            Path(analysis_dir) if client else None,
+            analysis_max_dimension, transcode_webp, asset_max_dimension, webp_quality, keep_originals,
+        )
+        renamed = {}
+        analysis_paths = {}
+        for (asset, analysis), original in zip(prepared, assets):
+            renamed[original] = f"assets/{asset.name}"
+            analysis_paths[original] = analysis
+
+        # Reused assets were re-encoded in their own run and only need a copy for analysis
+        redescribe_paths = [path for path in unique_paths if path not in renamed]
+        prepared = prepare_images(
+            [assets_dir.parent / path for path in redescribe_paths], Path(analysis_dir), analysis_max_dimension
+        )
+        for (_, analysis), path in zip(prepared, redescribe_paths):
+            renamed[path] = path
+            analysis_paths[path] = analysis
+
+        if client:
+            analyzed = analyze_images(
+                [analysis_paths[path] for path in unique_paths],
+                client, context, analysis_batch_size, analysis_concurrency, description_cache, deadline,
+            )
+            for path, text in zip(unique_paths, analyzed):
+                if text is None:
+                    deadline.skip("analysis", asset_urls[path][0])
+                descriptions[renamed[path]] = text or ""
+
+    local_paths = {url: renamed[path] for url, path in local_paths.items()}
+    local_paths.update({url: record["path"] for url, record in reused.items()})
+
+    if image_records is not None:
+        for url, path in local_paths.items():
+            image_records[url] = {"path": path, "description": descriptions.get(path, "")}
+
+    def describe(url):
+        return descriptions.get(local_paths.get(url), "")
+
+    # Assemble the output from slices of the original in a single join
+    parts = []
+    position = 0
+    for start, end, kind, text, key in tokens:
+        parts.append(markdown[position:start])
+        position = end
+
+        if kind == "refdef":
+            parts.append(local_paths.get(text, text) if definitions.get(key) == text else text)
+            continue
+
+        if kind == "inline":
+            url = key
+            rendered = f"![{text}]({local_paths[url]})" if url in local_paths else None
+        elif kind == "refimg":
+            url = definitions.get(key)
+            rendered = text if url in local_paths else None
+        else:
+            url = key
+            rendered = rewrite_html_image(text, local_paths)
+            if url not in local_paths:
+                parts.append(rendered)
+                continue
+
+        if rendered is None:
+            parts.append(markdown[start:end])
+            continue
+
+        description = describe(url)
+        parts.append(f"{rendered}\n\n*{description}*\n" if description else f"{rendered}\n")
+    parts.append(markdown[position:])
+
+    return "".join(parts)
+
+
+SUMMARY_FORMAT = """Write each summary as a concise paragraph (2-4 sentences):
 
 1. **ELI5** - Explain like I'm 5 years old. Use simple words, analogies, and relatable examples.
 2. **High School** - Explain for a high school student. Clear and educational with some technical terms.
@@ -162,67 +1957,771 @@ Format as:
 [paragraph]
 
 ### College Graduate
-[paragraph]
+[paragraph]"""
 
-Article:
-{article_content[:15000]}"""
 
-    response = client.models.generate_content(
-        model="gemini-2.0-flash",
-        contents=prompt
-    )
+def split_long_text(text: str, max_chars: int) -> list[str]:
+    pieces = []
+    current = ""
+    for paragraph in re.split(r"(?<=\n)\n+", text):
+        while len(paragraph) > max_chars:
+            if current:
+                pieces.append(current)
+                current = ""
+            pieces.append(paragraph[:max_chars])
+            paragraph = paragraph[max_chars:]
+        if current and len(current) + len(paragraph) + 1 > max_chars:
+            pieces.append(current)
+            current = ""
+        current = f"{current}\n{paragraph}" if current else paragraph
+    if current:
+        pieces.append(current)
+    return pieces
+
+
+def split_markdown_sections(markdown: str, max_chars: int) -> list[str]:
+    """Split on headings outside code fences, packing sections into chunks of at most max_chars."""
+    sections = []
+    current = []
+    in_fence = False
+    for line in markdown.splitlines(keepends=True):
+        if line.lstrip().startswith(("```", "~~~")):
+            in_fence = not in_fence
+        if not in_fence and re.match(r"#{1,6}\s", line) and current:
+            sections.append("".join(current))
+            current = []
+        current.append(line)
+    if current:
+        sections.append("".join(current))
+
+    chunks = []
+    chunk = ""
+    for section in sections:
+        if len(section) > max_chars:
+            if chunk:
+                chunks.append(chunk)
+                chunk = ""
+            chunks.extend(split_long_text(section, max_chars))
+        elif len(chunk) + len(section) > max_chars:
+            chunks.append(chunk)
+            chunk = section
+        else:
+            chunk += section
+    if chunk:
+        chunks.append(chunk)
+    return chunks
+
+
+def summarize_chunk(
+    chunk: str, client: genai.Client, index: int, total: int, deadline_at: float | None = None
+) -> str:
+    prompt = f"""This is part {index} of {total} of a longer article. Write dense notes (at most 150 words)
+covering its key facts, arguments, numbers and conclusions. Do not add an introduction.
+
+Article part:
+{chunk}"""
+
+    with profile_span("summarize_chunk", "gemini", part=index, chars=len(chunk)) as record:
+        response = generate_content(
+            client,
+            deadline_at,
+            model=GEMINI_MODEL,
+            contents=prompt
+        )
+        record_usage(record, response)
 
     return response.text
 
 
-def main():
-    parser = argparse.ArgumentParser(description="Convert webpage to markdown with images and summaries")
-    parser.add_argument("url", help="URL of the webpage to convert")
-    parser.add_argument("--output-dir", help="Output directory name (default: auto-generated timestamp)")
-    args = parser.parse_args()
+def generate_summary(
+    article_content: str,
+    client: genai.Client,
+    chunk_chars: int = DEFAULT_SUMMARY_CHUNK_CHARS,
+    on_text=None,
+    deadline_at: float | None = None,
+) -> str:
+    print("Generating summaries...")
 
-    api_key = load_api_key()
-    client = None
+    if len(article_content) <= chunk_chars:
+        prompt = f"""Analyze this article and create a Summary section with three subsections.
 
-    if not api_key:
-        print("Warning: GOOGLE_API_KEY not found. Images won't be analyzed and summaries won't be generated.")
+{SUMMARY_FORMAT}
+
+Article:
+{article_content}"""
     else:
-        client = genai.Client(api_key=api_key)
+        # Map: summarize every chunk in parallel so latency tracks the slowest chunk
+        chunks = split_markdown_sections(article_content, chunk_chars)
+        print(f"Article is {len(article_content)} characters - summarizing {len(chunks)} sections in parallel")
+        with ThreadPoolExecutor(max_workers=min(len(chunks), MAX_SUMMARY_WORKERS)) as executor:
+            notes = list(executor.map(
+                lambda item: summarize_chunk(item[1], client, item[0], len(chunks), deadline_at),
+                enumerate(chunks, 1),
+            ))
+
+        # Reduce: build the three-level summary from the per-section notes
+        section_notes = "\n\n".join(f"Part {i}:\n{note.strip()}" for i, note in enumerate(notes, 1))
+        prompt = f"""Below are notes covering every part of a long article, in order. Analyze them and
+create a Summary section with three subsections that reflects the whole article.
+
+{SUMMARY_FORMAT}
+
+Article notes:
+{section_notes}"""
+
+    with profile_span("summary", "gemini", chars=len(article_content)) as record:
+        if on_text:
+            response = generate_content_stream(client, on_text, deadline_at, model=GEMINI_MODEL, contents=prompt)
+        else:
+            response = generate_content(
+                client,
+                deadline_at,
+                model=GEMINI_MODEL,
+                contents=prompt
+            )
+        record_usage(record, response)
+
+    return response.text
+
 
+CONVERSION_RECORD = "conversion.json"
+
+
+def load_conversion_record(output_dir: Path) -> dict | None:
+    record_path = output_dir / CONVERSION_RECORD
+    if not record_path.exists() or not (output_dir / "article.md").exists():
+        return None
     try:
-        markdown = fetch_webpage(args.url)
-    except requests.RequestException as e:
-        print(f"Error: Failed to fetch webpage: {e}")
-        sys.exit(1)
+        return json.loads(record_path.read_text())
+    except ValueError:
+        return None
+
+
+def previous_summary_text(output_dir: Path, record: dict) -> str | None:
+    """Return the summary appended to the previous article.md if it is intact."""
+    if not record.get("summary_hash"):
+        return None
+    article = (output_dir / "article.md").read_text()
+    _, separator, summary = article.rpartition("\n\n---\n\n")
+    if separator and hashlib.sha256(summary.encode()).hexdigest() == record["summary_hash"]:
+        return summary
+    return None
+
+
+def save_conversion_record(
+    output_dir: Path, url: str, source_hash: str, summary: str | None, image_records: dict
+) -> None:
+    record = {
+        "url": url,
+        "converted_at": datetime.now().isoformat(timespec="seconds"),
+        "source_hash": source_hash,
+        "summary_hash": hashlib.sha256(summary.encode()).hexdigest() if summary else None,
+        "images": image_records,
+    }
+    (output_dir / CONVERSION_RECORD).write_text(json.dumps(record, indent=2))
 
-    if args.output_dir:
-        output_dir = Path(args.output_dir)
-    else:
-        timestamp = datetime.now().strftime("%Y%m%d_%H%M%S")
-        output_dir = Path(f"webpage_{timestamp}")
 
+class ArticleWriter:
+    """Keeps article.md current while the body is rewritten and the summary streams in."""
+
+    def __init__(self, path: Path):
+        self.path = path
+        self.body = ""
+        self.summary = ""
+        self.finished = False
+        self.lock = threading.Lock()
+
+    def _replace(self) -> None:
+        # Swap in the whole file so a reader never sees a half-written body
+        temp_path = self.path.with_name(f".{self.path.name}.tmp")
+        temp_path.write_text(f"{self.body}\n\n---\n\n{self.summary}" if self.summary else self.body)
+        os.replace(temp_path, self.path)
+
+    def write_body(self, body: str) -> None:
+        with self.lock:
+            self.body = body
+            self._replace()
+
+    def append_summary(self, text: str) -> None:
+        with self.lock:
+            if self.finished:
+                # A summary abandoned at the deadline may still be streaming
+                return
+            addition = text if self.summary else f"\n\n---\n\n{text}"
+            self.summary += text
+            with self.path.open("a") as article:
+                article.write(addition)
+
+    def finish(self, body: str, summary: str | None) -> None:
+        with self.lock:
+            self.body = body
+            self.summary = summary or ""
+            self.finished = True
+            self._replace()
+
+
+class ConversionResult:
+    """The article written for one URL, the images it references, and how long each stage took."""
+
+    def __init__(
+        self,
+        article_path: Path,
+        markdown: str,
+        summary: str | None,
+        images: dict,
+        timings: dict,
+        skipped: list,
+    ):
+        self.article_path = article_path
+        self.markdown = markdown
+        self.summary = summary
+        self.images = images
+        self.timings = timings
+        self.skipped = skipped
+
+    @property
+    def assets(self) -> list[Path]:
+        paths = dict.fromkeys(record["path"] for record in self.images.values())
+        return [self.article_path.parent / path for path in paths]
+
+
+def convert_article(
+    url: str,
+    output_dir: Path,
+    args: argparse.Namespace,
+    client: genai.Client | None,
+    session: requests.Session,
+    page_cache: PageCache | None = None,
+    image_cache: ImageCache | None = None,
+    description_cache: DescriptionCache | None = None,
+) -> ConversionResult:
+    timings = {}
+    article_started = time.perf_counter()
+    deadline = Deadline(args.deadline) if args.deadline else None
+
+    output_created = not output_dir.exists()
     output_dir.mkdir(parents=True, exist_ok=True)
     assets_dir = output_dir / "assets"
     assets_dir.mkdir(exist_ok=True)
+    previous = load_conversion_record(output_dir) if args.incremental else None
+    reusable = reusable_images(previous.get("images") if previous else None, assets_dir)
 
-    print("Processing images...")
-    processed_markdown = process_markdown_images(markdown, assets_dir, client)
+    # Image URLs in each streamed line of the fetch start downloading before the page is complete
+    pool = ImageDownloadPool(
+        assets_dir, args.max_concurrency, args.per_host_concurrency, session,
+        (args.connect_timeout, args.image_timeout), image_cache, int(args.max_image_mb * 1024 * 1024), deadline,
+    )
+
+    open_fence = None
+
+    def prefetch(line):
+        nonlocal open_fence
+        # Nothing inside a code fence is rewritten, so nothing in it is worth downloading
+        fence = FENCE_LINE_PATTERN.match(line)
+        if open_fence:
+            marker = fence.group(1) if fence else ""
+            if marker.startswith(open_fence) and not line[fence.end():].strip():
+                open_fence = None
+        elif fence:
+            open_fence = fence.group(1)
+        else:
+            scan_markdown_images(line, lambda image_url: image_url in reusable or pool.submit(image_url))
+
+    fetch_timeout = (args.connect_timeout, args.fetch_timeout)
+    if deadline:
+        fetch_timeout = tuple(min(limit, max(0.1, deadline.remaining())) for limit in fetch_timeout)
+
+    started = time.perf_counter()
+    try:
+        markdown = fetch_webpage(
+            url, session, fetch_timeout,
+            page_cache, args.refresh, args.offline, args.engine, prefetch
+        )
+    except Exception:
+        pool.close()
+        if output_created:
+            shutil.rmtree(output_dir, ignore_errors=True)
+        elif not any(assets_dir.iterdir()):
+            assets_dir.rmdir()
+        raise
+    timings["fetch_s"] = round(time.perf_counter() - started, 3)
+    if pool.futures:
+        print(f"Started {len(pool.futures)} image downloads while fetching")
+
+    source_hash = hashlib.sha256(markdown.encode()).hexdigest()
+    previous_summary = None
+    if previous and previous.get("source_hash") == source_hash:
+        previous_summary = previous_summary_text(output_dir, previous)
+        if previous_summary:
+            print("Article body unchanged - reusing previous summary")
 
-    if client:
+    article_path = output_dir / "article.md"
+    writer = None
+    if args.stream:
+        # Readers get the fetched article now; images and the summary land as they finish
+        writer = ArticleWriter(article_path)
+        writer.write_body(markdown)
+        print(f"Article body written to: {article_path.absolute()}")
+
+    def summarize(content):
+        if previous_summary:
+            if writer:
+                writer.append_summary(previous_summary)
+            return previous_summary
+        started = time.perf_counter()
         try:
-            summary = generate_summary(processed_markdown, client)
-            processed_markdown = f"{processed_markdown}\n\n---\n\n{summary}"
+            with profile_span("summary_stage", "stage", url=url):
+                return generate_summary(
+                    content, client, args.summary_chunk_chars, writer.append_summary if writer else None,
+                    deadline.cutoff() if deadline else None,
+                )
         except Exception as e:
-            print(f"Warning: Failed to generate summary: {e}")
+            if deadline and (isinstance(e, TimeoutError) or not deadline.remaining()):
+                deadline.skip("summary", "not finished before the deadline")
+            else:
+                print(f"Warning: Failed to generate summary: {e}")
+            return None
+        finally:
+            timings["summary_s"] = round(time.perf_counter() - started, 3)
 
-    article_path = output_dir / "article.md"
-    article_path.write_text(processed_markdown)
+    # The summary only needs the fetched text, so it can run while images are processed
+    summary_executor = None
+    summary_future = None
+    if client and args.overlap_summary:
+        summary_executor = ThreadPoolExecutor(max_workers=1)
+        summary_future = summary_executor.submit(summarize, markdown)
+
+    print("Processing images...")
+    started = time.perf_counter()
+    image_records = {}
+    try:
+        with profile_span("images", "stage", url=url):
+            processed_markdown = process_markdown_images(
+                markdown, assets_dir, client, args.max_concurrency, args.per_host_concurrency,
+                session, (args.connect_timeout, args.image_timeout), image_cache,
+                int(args.max_image_mb * 1024 * 1024), args.analysis_batch_size, args.analysis_concurrency,
+                description_cache,
+                analysis_max_dimension=args.analysis_max_dimension,
+                transcode_webp=args.webp,
+                asset_max_dimension=args.asset_max_dimension,
+                webp_quality=args.webp_quality,
+                keep_originals=args.keep_originals,
+                near_duplicates=args.near_duplicates,
+                phash_threshold=args.phash_threshold,
+                skip_decorative=args.skip_decorative,
+                decorative_max_dimension=args.decorative_max_dimension,
+                decorative_max_aspect=args.decorative_max_aspect,
+                decorative_min_bytes=args.decorative_min_bytes,
+                decorative_min_entropy=args.decorative_min_entropy,
+                decorative_url_pattern=args.decorative_url_pattern,
+                decorative_url_max_dimension=args.decorative_url_max_dimension,
+                previous_images=previous.get("images") if previous else None,
+                image_records=image_records,
+                pool=pool,
+                deadline=deadline,
+            )
+    finally:
+        pool.close()
+        if summary_executor:
+            summary_executor.shutdown(wait=False)
+    timings["images_s"] = round(time.perf_counter() - started, 3)
+    if writer:
+        writer.write_body(processed_markdown)
+
+    summary = None
+    if summary_future:
+        if wait([summary_future], timeout=deadline.remaining() if deadline else None).done:
+            summary = summary_future.result()
+        else:
+            deadline.skip("summary", "not finished before the deadline")
+    elif client:
+        summary = summarize(processed_markdown)
+
+    article = f"{processed_markdown}\n\n---\n\n{summary}" if summary else processed_markdown
+    if writer:
+        # Settles the file to exactly body plus summary, dropping any text from a failed stream
+        writer.finish(processed_markdown, summary)
+    else:
+        article_path.write_text(article)
+    save_conversion_record(output_dir, url, source_hash, summary, image_records)
+
+    if previous or (deadline and deadline.skipped):
+        # Drop assets left over from images the article no longer references, or that landed after a cutoff
+        referenced = {Path(record["path"]).name for record in image_records.values()}
+        for asset in assets_dir.iterdir():
+            if asset.is_file() and asset.name not in referenced:
+                asset.unlink()
 
     if not any(assets_dir.iterdir()):
         assets_dir.rmdir()
         print("No images downloaded - removed empty assets folder")
 
-    print(f"\nSuccess! Article saved to: {article_path.resolve()}")
+    timings["total_s"] = round(time.perf_counter() - article_started, 3)
+    print("Timings: " + ", ".join(f"{stage[:-2]} {seconds:.2f}s" for stage, seconds in timings.items()))
+    if deadline and deadline.skipped:
+        print(f"Deadline of {args.deadline:g}s reached - skipped {len(deadline.skipped)} items (remote URLs kept):")
+        for stage, item in deadline.skipped:
+            print(f"  {stage}: {item}")
+    return ConversionResult(
+        article_path, article, summary, image_records, timings, deadline.skipped if deadline else []
+    )
+
+
+def read_url_list(source: str) -> list[str]:
+    text = sys.stdin.read() if source == "-" else Path(source).read_text()
+    urls = []
+    for line in text.splitlines():
+        line = line.strip()
+        if line and not line.startswith("#") and line not in urls:
+            urls.append(line)
+    return urls
+
+
+def batch_output_dir(root: Path, url: str) -> Path:
+    parsed = urlparse(url)
+    slug = re.sub(r"[^A-Za-z0-9]+", "-", f"{parsed.netloc}{parsed.path}").strip("-")[:60]
+    digest = hashlib.md5(normalize_url(url).encode()).hexdigest()[:8]
+    return root / f"{slug or 'page'}-{digest}"
+
+
+class Manifest:
+    """JSON record of each URL's output directory, status and timings."""
+
+    def __init__(self, path: Path):
+        self.path = path
+        self.lock = threading.Lock()
+        self.entries = json.loads(path.read_text()) if path.exists() else {}
+
+    def is_done(self, url: str) -> bool:
+        return self.entries.get(url, {}).get("status") == "done"
+
+    def update(self, url: str, **fields) -> None:
+        with self.lock:
+            self.entries.setdefault(url, {}).update(fields)
+            tmp_path = self.path.with_suffix(".tmp")
+            tmp_path.write_text(json.dumps(self.entries, indent=2))
+            os.replace(tmp_path, self.path)
+
+
+def run_batch(
+    urls: list[str],
+    root: Path,
+    args: argparse.Namespace,
+    client: genai.Client | None,
+    session: requests.Session,
+    page_cache: PageCache | None = None,
+    image_cache: ImageCache | None = None,
+    description_cache: DescriptionCache | None = None,
+) -> int:
+    root.mkdir(parents=True, exist_ok=True)
+    manifest = Manifest(root / "manifest.json")
+
+    pending = [url for url in urls if not manifest.is_done(url)]
+    if len(pending) < len(urls):
+        print(f"Resuming: {len(urls) - len(pending)} of {len(urls)} URLs already converted")
+
+    def convert(url):
+        output_dir = batch_output_dir(root, url)
+        manifest.update(
+            url, output_dir=str(output_dir), status="running",
+            started_at=datetime.now().isoformat(timespec="seconds"), error=None
+        )
+        started = time.perf_counter()
+        try:
+            timings = convert_article(
+                url, output_dir, args, client, session, page_cache, image_cache, description_cache
+            ).timings
+        except Exception as e:
+            print(f"Error: Failed to convert {url}: {e}")
+            manifest.update(url, status="failed", error=str(e),
+                            total_s=round(time.perf_counter() - started, 3))
+            return False
+        manifest.update(url, status="done", timings=timings,
+                        total_s=round(time.perf_counter() - started, 3))
+        print(f"Converted: {url} -> {output_dir}")
+        return True
+
+    with ThreadPoolExecutor(max_workers=max(1, args.workers)) as executor:
+        results = list(executor.map(convert, pending))
+
+    failed = results.count(False)
+    print(f"\nBatch finished: {len(results) - failed} converted, {failed} failed. Manifest: {manifest.path.resolve()}")
+    return failed
+
+
+def print_profile(profiler: Profiler, directory: Path) -> None:
+    report_path, trace_path = profiler.write(directory)
+    print("\nProfile:")
+    for name, stage in sorted(profiler.summary().items(), key=lambda item: -item[1]["total_s"]):
+        tokens = stage["prompt_tokens"] + stage["output_tokens"]
+        print(f"  {name:<20} x{stage['count']:<4} {stage['total_s']:8.2f}s total  {stage['max_s']:7.2f}s max  "
+              f"{stage['bytes'] / 1024:9.1f} KB  {tokens:7d} tokens")
+    print(f"Profile report: {report_path.resolve()}")
+    print(f"Chrome trace (load in chrome://tracing or ui.perfetto.dev): {trace_path.resolve()}")
+
+
+def build_parser() -> argparse.ArgumentParser:
+    parser = argparse.ArgumentParser(description="Convert webpage to markdown with images and summaries")
+    parser.add_argument("url", nargs="?", help="URL of the webpage to convert")
+    parser.add_argument("--urls-file",
+                        help="Convert every URL listed in this file (one per line, '-' for stdin)")
+    parser.add_argument("--output-dir", help="Output directory name (default: auto-generated timestamp)")
+    parser.add_argument("--engine", choices=sorted(EXTRACTORS), default=DEFAULT_ENGINE,
+                        help="Extract markdown via Jina Reader or locally from the raw HTML (default: jina)")
+    parser.add_argument("--incremental", action="store_true",
+                        help="Reuse images, descriptions and the summary from a previous conversion in --output-dir")
+    parser.add_argument("--profile", action="store_true",
+                        help="Write profile.json and a Chrome trace (trace.json) with per-stage timings, "
+                             "bytes and token usage")
+    parser.add_argument("--workers", type=int, default=DEFAULT_WORKERS,
+                        help=f"Articles converted in parallel with --urls-file (default: {DEFAULT_WORKERS})")
+    parser.add_argument("--max-http-requests", type=int, default=DEFAULT_MAX_HTTP_REQUESTS,
+                        help=f"Global cap on in-flight HTTP requests (default: {DEFAULT_MAX_HTTP_REQUESTS})")
+    parser.add_argument("--max-gemini-requests", type=int, default=DEFAULT_MAX_GEMINI_REQUESTS,
+                        help=f"Ceiling on in-flight Gemini requests; halved on 429 and ramped back up "
+                             f"(default: {DEFAULT_MAX_GEMINI_REQUESTS})")
+    parser.add_argument("--gemini-rpm", type=int, default=DEFAULT_GEMINI_RPM,
+                        help=f"Gemini requests per minute quota, 0 = unpaced (default: {DEFAULT_GEMINI_RPM})")
+    parser.add_argument("--gemini-tpm", type=int, default=DEFAULT_GEMINI_TPM,
+                        help=f"Gemini tokens per minute quota, 0 = unpaced (default: {DEFAULT_GEMINI_TPM})")
+    parser.add_argument("--max-concurrency", type=int, default=DEFAULT_MAX_CONCURRENCY,
+                        help=f"Maximum parallel image downloads (default: {DEFAULT_MAX_CONCURRENCY}, 1 = serial)")
+    parser.add_argument("--per-host-concurrency", type=int, default=DEFAULT_PER_HOST_CONCURRENCY,
+                        help=f"Maximum parallel downloads from a single host (default: {DEFAULT_PER_HOST_CONCURRENCY})")
+    parser.add_argument("--pool-size", type=int, default=DEFAULT_POOL_SIZE,
+                        help=f"Keep-alive connections kept per host (default: {DEFAULT_POOL_SIZE})")
+    parser.add_argument("--retries", type=int, default=DEFAULT_RETRIES,
+                        help=f"Retries with exponential backoff on 429/503 (default: {DEFAULT_RETRIES})")
+    parser.add_argument("--connect-timeout", type=float, default=DEFAULT_CONNECT_TIMEOUT,
+                        help=f"Connect timeout in seconds (default: {DEFAULT_CONNECT_TIMEOUT:g})")
+    parser.add_argument("--fetch-timeout", type=float, default=DEFAULT_FETCH_READ_TIMEOUT,
+                        help=f"Read timeout for the Jina Reader fetch in seconds (default: {DEFAULT_FETCH_READ_TIMEOUT:g})")
+    parser.add_argument("--image-timeout", type=float, default=DEFAULT_IMAGE_READ_TIMEOUT,
+                        help=f"Read timeout per image download in seconds (default: {DEFAULT_IMAGE_READ_TIMEOUT:g})")
+    parser.add_argument("--cache-dir", type=Path, default=DEFAULT_CACHE_DIR,
+                        help=f"Persistent cache directory shared across runs (default: {DEFAULT_CACHE_DIR})")
+    parser.add_argument("--image-cache-mb", type=int, default=DEFAULT_IMAGE_CACHE_MB,
+                        help=f"Maximum size of the image cache before LRU eviction (default: {DEFAULT_IMAGE_CACHE_MB})")
+    parser.add_argument("--page-ttl-hours", type=float, default=DEFAULT_PAGE_TTL_HOURS,
+                        help=f"Hours a cached Jina Reader response is reused (default: {DEFAULT_PAGE_TTL_HOURS})")
+    parser.add_argument("--page-cache-entries", type=int, default=DEFAULT_PAGE_CACHE_ENTRIES,
+                        help=f"Maximum cached page responses, kept past their TTL for --offline "
+                             f"(default: {DEFAULT_PAGE_CACHE_ENTRIES})")
+    parser.add_argument("--refresh", action="store_true",
+                        help="Ignore the cached Jina Reader response and fetch again")
+    parser.add_argument("--offline", action="store_true",
+                        help="Only serve the page from the cache, never contacting Jina Reader")
+    parser.add_argument("--description-ttl-days", type=float, default=DEFAULT_DESCRIPTION_TTL_DAYS,
+                        help=f"Days a cached image description stays valid (default: {DEFAULT_DESCRIPTION_TTL_DAYS})")
+    parser.add_argument("--description-cache-entries", type=int, default=DEFAULT_DESCRIPTION_CACHE_ENTRIES,
+                        help=f"Maximum cached image descriptions (default: {DEFAULT_DESCRIPTION_CACHE_ENTRIES})")
+    parser.add_argument("--no-cache", action="store_true",
+                        help="Disable the persistent page, image and description caches")
+    parser.add_argument("--max-image-mb", type=float, default=DEFAULT_MAX_IMAGE_MB,
+                        help=f"Abort image downloads larger than this many MB (default: {DEFAULT_MAX_IMAGE_MB})")
+    parser.add_argument("--analysis-batch-size", type=int, default=DEFAULT_ANALYSIS_BATCH_SIZE,
+                        help="Images described per Gemini request; 1 sends one request per image (default: 1)")
+    parser.add_argument("--analysis-max-dimension", type=int, default=0,
+                        help="Downscale images to this many pixels on the longest side before Gemini analysis "
+                             "(default: 0, send full resolution; requires Pillow)")
+    parser.add_argument("--webp", action="store_true",
+                        help="Re-encode stored assets to WebP when it makes them smaller (requires Pillow)")
+    parser.add_argument("--asset-max-dimension", type=int, default=0,
+                        help="With --webp, also downscale stored assets to this many pixels (default: 0, keep size)")
+    parser.add_argument("--webp-quality", type=int, default=DEFAULT_WEBP_QUALITY,
+                        help=f"WebP quality for --webp (default: {DEFAULT_WEBP_QUALITY})")
+    parser.add_argument("--keep-originals", action="store_true",
+                        help="With --webp, keep the original downloaded bytes in assets/originals/")
+    parser.add_argument("--near-duplicates", choices=["off", "article", "global"], default="off",
+                        help="Collapse perceptually near-identical images within the article, or also against "
+                             "the image cache (default: off; requires Pillow and NumPy)")
+    parser.add_argument("--phash-threshold", type=int, default=DEFAULT_PHASH_THRESHOLD,
+                        help=f"Maximum dHash bit distance (of 64) treated as a near duplicate (default: {DEFAULT_PHASH_THRESHOLD})")
+    parser.add_argument("--skip-decorative", action="store_true",
+                        help="Do not send tracking pixels, icons, avatars, dividers or blank images to Gemini "
+                             "(requires Pillow)")
+    parser.add_argument("--decorative-max-dimension", type=int, default=DEFAULT_DECORATIVE_MAX_DIMENSION,
+                        help="With --skip-decorative, images whose longest side is at most this many pixels "
+                             f"are skipped (default: {DEFAULT_DECORATIVE_MAX_DIMENSION})")
+    parser.add_argument("--decorative-max-aspect", type=float, default=DEFAULT_DECORATIVE_MAX_ASPECT,
+                        help="With --skip-decorative, images at least this many times wider than tall (or the "
+                             f"reverse) are skipped (default: {DEFAULT_DECORATIVE_MAX_ASPECT:g})")
+    parser.add_argument("--decorative-min-bytes", type=int, default=DEFAULT_DECORATIVE_MIN_BYTES,
+                        help=f"With --skip-decorative, files smaller than this are skipped (default: {DEFAULT_DECORATIVE_MIN_BYTES})")
+    parser.add_argument("--decorative-min-entropy", type=float, default=DEFAULT_DECORATIVE_MIN_ENTROPY,
+                        help="With --skip-decorative, images whose grayscale histogram entropy is below this "
+                             f"many bits are skipped as blank (default: {DEFAULT_DECORATIVE_MIN_ENTROPY:g})")
+    parser.add_argument("--decorative-url-pattern", default=DEFAULT_DECORATIVE_URL_PATTERN,
+                        help="With --skip-decorative, case-insensitive regex matched against each image's host "
+                             "and path; an empty string disables URL matching")
+    parser.add_argument("--decorative-url-max-dimension", type=int, default=DEFAULT_DECORATIVE_URL_MAX_DIMENSION,
+                        help="With --skip-decorative, a URL match only skips images whose longest side is at most "
+                             f"this many pixels (default: {DEFAULT_DECORATIVE_URL_MAX_DIMENSION})")
+    parser.add_argument("--summary-chunk-chars", type=int, default=DEFAULT_SUMMARY_CHUNK_CHARS,
+                        help="Articles longer than this are summarized section by section and then "
+                             f"combined (default: {DEFAULT_SUMMARY_CHUNK_CHARS})")
+    parser.add_argument("--overlap-summary", action="store_true",
+                        help="Generate the summary from the fetched text while images are processed")
+    parser.add_argument("--stream", action="store_true",
+                        help="Write article.md as soon as the page is fetched and stream the summary into it")
+    parser.add_argument("--deadline", type=float, default=0,
+                        help="Total time budget in seconds per article; downloads, image analyses and the summary "
+                             "still outstanding when it runs low are skipped and the article is written anyway "
+                             "(default: 0, no budget)")
+    parser.add_argument("--analysis-concurrency", type=int, default=DEFAULT_ANALYSIS_CONCURRENCY,
+                        help=f"Parallel Gemini image-analysis requests (default: {DEFAULT_ANALYSIS_CONCURRENCY})")
+    return parser
+
+
+def check_options(args: argparse.Namespace) -> None:
+    """Raise ValueError for conflicting options and ImportError for missing optional dependencies."""
+    if args.offline and args.no_cache:
+        raise ValueError("--offline needs the page cache and cannot be combined with --no-cache")
+    if (args.analysis_max_dimension or args.webp or args.near_duplicates != "off" or args.skip_decorative) \
+            and Image is None:
+        raise ImportError("Pillow not installed. Run: pip install pillow (or poetry install -E images)")
+    if args.near_duplicates != "off" and np is None:
+        raise ImportError("numpy not installed. Run: pip install numpy (or poetry install -E images)")
+    if args.near_duplicates == "global" and args.no_cache:
+        raise ValueError("--near-duplicates global needs the image cache and cannot be combined with --no-cache")
+    try:
+        re.compile(args.decorative_url_pattern)
+    except re.error as e:
+        raise ValueError(f"--decorative-url-pattern is not a valid regular expression: {e}")
+
+
+def open_caches(args: argparse.Namespace) -> tuple[PageCache | None, ImageCache | None, DescriptionCache | None]:
+    """The page, image and description caches selected by args; close them with close_caches."""
+    if args.no_cache:
+        return None, None, None
+    return (
+        PageCache(args.cache_dir, args.page_ttl_hours * 3600, args.page_cache_entries),
+        ImageCache(args.cache_dir, args.image_cache_mb * 1024 * 1024),
+        DescriptionCache(args.cache_dir, args.description_ttl_days * 86400, args.description_cache_entries),
+    )
+
+
+def close_caches(caches: tuple) -> None:
+    for cache in caches:
+        if cache:
+            cache.close()
+
+
+class ConversionError(Exception):
+    """A conversion that produced no article, with the URL, the failing stage and the HTTP status if any."""
+
+    def __init__(self, url: str, stage: str, cause: Exception):
+        response = getattr(cause, "response", None)
+        self.url = url
+        self.stage = stage
+        self.cause = cause
+        self.status = response.status_code if response is not None else None
+        status = f" (HTTP {self.status})" if self.status else ""
+        super().__init__(f"{stage} failed for {url}{status}: {cause}")
+
+
+def convert_webpage(
+    url: str,
+    output_dir: Path | str,
+    client: genai.Client | None = None,
+    session: requests.Session | None = None,
+    caches: tuple[PageCache | None, ImageCache | None, DescriptionCache | None] | None = None,
+    **options,
+) -> ConversionResult:
+    """Convert one webpage in-process and return what was written.
+
+    options are the command-line flags as keyword arguments (engine="local",
+    deadline=30, no_cache=True, ...); anything not given takes the CLI default.
+    Pass the caller's Gemini client and HTTP session to share their
+    connection pools; without a client, images are not described and no
+    summary is generated. A deadline makes image downloads use a retry-free
+    view of the session that still shares its pools. caches is the
+    (page, image, description) tuple from open_caches, for callers that
+    convert many pages and keep the caches open between calls; otherwise
+    the caches are opened and closed for this call. Request limits and the
+    profiler are the process-wide ones set with set_request_limits and
+    set_profiler.
+    """
+    args = build_parser().parse_args([url])
+    unknown = set(options) - set(vars(args))
+    if unknown:
+        raise TypeError(f"unknown conversion options: {', '.join(sorted(unknown))}")
+    vars(args).update(options)
+    args.output_dir = str(output_dir)
+    args.cache_dir = Path(args.cache_dir)
+    check_options(args)
+
+    own_session = session is None
+    if own_session:
+        session = create_session(args.pool_size, args.retries)
+    own_caches = caches is None
+    if own_caches:
+        caches = open_caches(args)
+    try:
+        return convert_article(url, Path(output_dir), args, client, session, *caches)
+    except (requests.RequestException, OfflineCacheMiss) as e:
+        raise ConversionError(url, "fetch", e) from e
+    finally:
+        if own_caches:
+            close_caches(caches)
+        if own_session:
+            session.close()
+
+
+def main():
+    parser = build_parser()
+    args = parser.parse_args()
+
+    if bool(args.url) == bool(args.urls_file):
+        parser.error("provide either a URL or --urls-file")
+    if args.incremental and args.url and not args.output_dir:
+        parser.error("--incremental needs the --output-dir of the previous conversion")
+    try:
+        check_options(args)
+    except ValueError as e:
+        parser.error(str(e))
+    except ImportError as e:
+        print(f"Error: {e}")
+        sys.exit(1)
+
+    api_key = load_api_key()
+    client = None
+
+    if not api_key:
+        print("Warning: GOOGLE_API_KEY not found. Images won't be analyzed and summaries won't be generated.")
+    else:
+        client = genai.Client(api_key=api_key)
+
+    set_request_limits(args.max_http_requests, args.max_gemini_requests, args.gemini_rpm, args.gemini_tpm)
+    profiler = Profiler() if args.profile else None
+    set_profiler(profiler)
+    session = create_session(args.pool_size, args.retries)
+    page_cache, image_cache, description_cache = open_caches(args)
+
+    timestamp = datetime.now().strftime("%Y%m%d_%H%M%S")
+
+    if args.urls_file:
+        urls = read_url_list(args.urls_file)
+        root = Path(args.output_dir) if args.output_dir else Path(f"webpages_{timestamp}")
+        failed = run_batch(urls, root, args, client, session, page_cache, image_cache, description_cache)
+        if profiler:
+            print_profile(profiler, root)
+        sys.exit(1 if failed else 0)
+
+    output_dir = Path(args.output_dir) if args.output_dir else Path(f"webpage_{timestamp}")
+
+    try:
+        convert_article(
+            args.url, output_dir, args, client, session, page_cache, image_cache, description_cache
+        )
+    except (requests.RequestException, OfflineCacheMiss) as e:
+        print(f"Error: Failed to fetch webpage: {e}")
+        sys.exit(1)
+
+    if profiler:
+        print_profile(profiler, output_dir)
+
+    print(f"\nSuccess! Article saved to: {(output_dir / 'article.md').resolve()}")
 
 
 if __name__ == "__main__":
@@ -0,0 +1,520 @@
+#!/usr/bin/env python3
+"""
+Behavioural tests for the webpage-to-markdown converter.
+
+Run with: poetry install --with dev && poetry run pytest -q claude/skills/webpage-to-markdown/scripts
+Pages and images are served from a temporary directory by http.server, and
+Gemini is replaced by a stub client, so no test touches the network.
+"""
+
+import functools
+import http.server
+import json
+import struct
+import sys
+import threading
+import time
+import zlib
+from pathlib import Path
+
+import pytest
+
+sys.path.insert(0, str(Path(__file__).parent))
+
+from convert_webpage import (  # noqa: E402
+    Deadline,
+    DescriptionCache,
+    DOMBuilder,
+    GeminiLimiter,
+    ImageCache,
+    PageCache,
+    analyze_images,
+    collapse_near_duplicates,
+    convert_webpage as convert,
+    create_session,
+    fetch_webpage,
+    find_main_content,
+    html_to_markdown,
+    prepare_images,
+    process_markdown_images,
+    scan_markdown_images,
+)
+
+ARTICLE_TEXT = (
+    "Connection pools let a client reuse TCP and TLS sessions between requests to the same host. "
+    "Without one, every request pays for a fresh handshake, which dominates the cost of small downloads. "
+)
+
+FIXTURE_PAGE = f"""<!doctype html>
+<html>
+<head>
+  <title>Pooling - Example Blog</title>
+  <meta property="og:title" content="Why connection pools matter">
+  <script>var tracking = "should not appear";</script>
+</head>
+<body>
+  <nav><a href="/">Home</a> <a href="/about">About</a></nav>
+  <div class="sidebar"><p>Subscribe to the newsletter for more posts like this one.</p></div>
+  <article>
+    <h1>Why connection pools matter</h1>
+    <p>{ARTICLE_TEXT}</p>
+    <p>{ARTICLE_TEXT}See <a href="/docs/pools.html">the pooling docs</a> for details.</p>
+    <img data-src="images/diagram.png" src="data:image/gif;base64,R0lGODlhAQABAAAAACw=" alt="Pool diagram">
+    <ul><li>Fewer handshakes<li>Lower latency</ul>
+    <pre><code class="language-python">session = requests.Session()
+session.get(url)</code></pre>
+    <p>{ARTICLE_TEXT}</p>
+  </article>
+  <footer><p>Copyright Example Blog</p></footer>
+</body>
+</html>
+"""
+
+
+def png_bytes(width: int = 4, height: int = 4) -> bytes:
+    """A valid RGB PNG of the given size."""
+
+    def chunk(kind: bytes, data: bytes) -> bytes:
+        return struct.pack(">I", len(data)) + kind + data + struct.pack(">I", zlib.crc32(kind + data))
+
+    rows = b"".join(b"\x00" + b"\x80\x40\x20" * width for _ in range(height))
+    return (b"\x89PNG\r\n\x1a\n"
+            + chunk(b"IHDR", struct.pack(">IIBBBBB", width, height, 8, 2, 0, 0, 0))
+            + chunk(b"IDAT", zlib.compress(rows))
+            + chunk(b"IEND", b""))
+
+
+GALLERY_IMAGES = [f"figure-{index}.png" for index in range(1, 7)]
+
+GALLERY_PAGE = f"""<html><head><title>Gallery</title></head><body><article>
+<p>{ARTICLE_TEXT * 3}</p>
+{"".join(f'<p><img src="images/{name}" alt="Figure {index}"></p>' for index, name in enumerate(GALLERY_IMAGES, 1))}
+<p>{ARTICLE_TEXT * 3}</p>
+</article></body></html>
+"""
+
+
+class Site:
+    """A local server's base URL, the status of every request it answered, and its peak concurrency."""
+
+    def __init__(self):
+        self.url = ""
+        self.requests = []
+        self.in_flight = 0
+        self.max_in_flight = 0
+        self.lock = threading.Lock()
+
+
+class RecordingHandler(http.server.SimpleHTTPRequestHandler):
+    site = None
+    # Long enough for concurrent downloads to overlap
+    delay = 0.05
+
+    def do_GET(self):
+        with self.site.lock:
+            self.site.in_flight += 1
+            self.site.max_in_flight = max(self.site.max_in_flight, self.site.in_flight)
+        try:
+            time.sleep(self.delay)
+            super().do_GET()
+        finally:
+            with self.site.lock:
+                self.site.in_flight -= 1
+
+    def log_request(self, code="-", size="-"):
+        with self.site.lock:
+            self.site.requests.append((self.path, int(code)))
+
+    def log_message(self, format, *args):
+        pass
+
+
+@pytest.fixture
+def served(tmp_path):
+    """A local server for a directory holding the fixture pages and their images."""
+    root = tmp_path / "site"
+    (root / "images").mkdir(parents=True)
+    (root / "page.html").write_text(FIXTURE_PAGE)
+    (root / "gallery.html").write_text(GALLERY_PAGE)
+    # Distinct sizes, since identical images share one content-addressed asset
+    names = ["diagram.png", "one.png", "two.png", "small.png", "large.png"] + GALLERY_IMAGES
+    for size, name in enumerate(names, start=4):
+        (root / "images" / name).write_bytes(png_bytes(size, size))
+
+    site = Site()
+    handler = type("Handler", (RecordingHandler,), {"site": site})
+    server = http.server.ThreadingHTTPServer(("127.0.0.1", 0), functools.partial(handler, directory=str(root)))
+    server.daemon_threads = True
+    thread = threading.Thread(target=server.serve_forever, daemon=True)
+    thread.start()
+    site.url = f"http://127.0.0.1:{server.server_address[1]}"
+    yield site
+    server.shutdown()
+    server.server_close()
+
+
+@pytest.fixture
+def site(served):
+    """Base URL of the local fixture server."""
+    return served.url
+
+
+class StubResponse:
+    def __init__(self, text: str):
+        self.text = text
+        self.usage_metadata = None
+
+
+class StubModels:
+    """Answers generate_content like Gemini would, after a short delay so calls overlap."""
+
+    def __init__(self, delay: float = 0.02):
+        self.calls = 0
+        self.delay = delay
+        self.lock = threading.Lock()
+
+    def generate_content(self, model, contents, config=None):
+        with self.lock:
+            self.calls += 1
+            call = self.calls
+        time.sleep(self.delay)
+        if isinstance(contents, str):
+            return StubResponse(f"## Summary\n\nAn article of {len(contents)} characters.")
+        images = [part for part in contents if isinstance(part, str) and part.startswith("Image ")]
+        if images:
+            return StubResponse(json.dumps([
+                {"index": index, "description": f"Batch {call} image {index}"} for index in range(1, len(images) + 1)
+            ]))
+        return StubResponse(f"Image described by call {call}")
+
+    def generate_content_stream(self, model, contents, config=None):
+        yield self.generate_content(model, contents, config)
+
+
+class StubClient:
+    def __init__(self, delay: float = 0.02):
+        self.models = StubModels(delay)
+
+
+def parse(html: str):
+    builder = DOMBuilder()
+    builder.feed(html)
+    builder.close()
+    return builder.root
+
+
+# Local extractor
+
+def test_dom_builder_closes_implicit_paragraphs_and_list_items():
+    root = parse("<ul><li>one<li>two</ul><p>first<p>second<div>block</div>")
+
+    ul = next(root.iter("ul"))
+    assert [li.text_content() for li in ul.iter("li")] == ["one", "two"]
+    assert [p.text_content() for p in root.iter("p")] == ["first", "second"]
+    assert next(root.iter("div")).parent is root
+
+
+def test_find_main_content_scores_paragraphs_without_landmarks():
+    paragraphs = "".join(f"<p>{ARTICLE_TEXT}</p>" for _ in range(3))
+    root = parse(
+        '<div id="menu"><p><a href="/a">A</a> <a href="/b">B</a> <a href="/c">C</a></p></div>'
+        f'<div id="story">{paragraphs}</div>'
+    )
+
+    assert find_main_content(root).attrs.get("id") == "story"
+
+
+def test_find_main_content_prefers_a_long_article_landmark():
+    root = parse(f"<div><p>{ARTICLE_TEXT}</p></div><article><p>{ARTICLE_TEXT * 4}</p></article>")
+
+    assert find_main_content(root).tag == "article"
+
+
+def test_html_to_markdown_extracts_the_article():
+    markdown = html_to_markdown(FIXTURE_PAGE, "https://blog.example.com/posts/pooling.html")
+
+    assert markdown.startswith("# Why connection pools matter\n\n")
+    # The article's own H1 repeats the title and is dropped
+    assert markdown.count("Why connection pools matter") == 1
+    assert "[the pooling docs](https://blog.example.com/docs/pools.html)" in markdown
+    assert "![Pool diagram](https://blog.example.com/posts/images/diagram.png)" in markdown
+    assert "- Fewer handshakes\n- Lower latency" in markdown
+    assert "```python\nsession = requests.Session()\nsession.get(url)\n```" in markdown
+    for boilerplate in ("Home", "newsletter", "Copyright", "tracking"):
+        assert boilerplate not in markdown
+
+
+def test_local_engine_fetches_the_served_page(site):
+    with create_session() as session:
+        markdown = fetch_webpage(f"{site}/page.html", session, timeout=(5, 5), engine="local")
+
+    assert markdown.startswith("# Why connection pools matter\n\n")
+    assert f"![Pool diagram]({site}/images/diagram.png)" in markdown
+
+
+def test_convert_webpage_writes_the_article_and_its_assets(site, tmp_path):
+    result = convert(f"{site}/page.html", tmp_path / "out", engine="local", no_cache=True)
+
+    assert result.article_path.exists()
+    assert [path.suffix for path in result.assets] == [".png"]
+    assert all(path.exists() for path in result.assets)
+    assert "![Pool diagram](assets/" in result.markdown
+    assert f"{site}/images/" not in result.markdown
+
+
+# Image tokenizer
+
+FENCED = """```markdown
+![not an image](http://example.com/fenced.png)
+[ref]: http://example.com/fenced-def.png
+```
+
+~~~
+<img src="http://example.com/tilde.png">
+~~~
+"""
+
+
+@pytest.mark.parametrize("markdown", [
+    "# Title\n\nNo images here, just [a link](http://example.com/page).\n",
+    FENCED,
+    "Inline code `![x](http://example.com/span.png)` and ``![y](http://example.com/`tick`.png)`` stay put.\n",
+    "```\nunclosed ![x](http://example.com/open.png)\n",
+])
+def test_scan_ignores_code_and_round_trips_unchanged(markdown, tmp_path):
+    _, _, _, described = scan_markdown_images(markdown)
+
+    assert described == []
+    assert process_markdown_images(markdown, tmp_path / "assets", client=None) == markdown
+
+
+def test_scan_resolves_reference_images_in_any_order():
+    markdown = (
+        "[early]: http://example.com/early.png\n\n"
+        "![Early][early] then ![Late][late] and ![Collapsed][]\n\n"
+        "[late]: http://example.com/late.png\n"
+        "[collapsed]: http://example.com/collapsed.png\n"
+        "[unused]: http://example.com/unused.png\n"
+    )
+    discovered = []
+
+    _, _, definitions, described = scan_markdown_images(markdown, on_url=discovered.append)
+
+    expected = ["http://example.com/early.png", "http://example.com/late.png", "http://example.com/collapsed.png"]
+    assert described == expected
+    assert sorted(discovered) == sorted(expected)
+    assert "unused" not in definitions
+
+
+def test_scan_reads_html_images_and_srcset():
+    markdown = '<img src="http://example.com/small.png" srcset="http://example.com/small.png 1x, http://example.com/large.png 2x">\n'
+    discovered = []
+
+    _, _, _, described = scan_markdown_images(markdown, on_url=discovered.append)
+
+    assert described == ["http://example.com/small.png"]
+    assert "http://example.com/large.png" in discovered
+
+
+def test_process_rewrites_images_but_not_code(site, tmp_path):
+    markdown = (
+        "# Title\n\n"
+        f"![One]({site}/images/one.png)\n\n"
+        "![Two][two]\n\n"
+        f'<img src="{site}/images/small.png" srcset="{site}/images/large.png 2x">\n\n'
+        f"{FENCED}\n"
+        f"Code `![x]({site}/images/one.png)` stays.\n\n"
+        f"[two]: {site}/images/two.png\n"
+    )
+
+    assets_dir = tmp_path / "assets"
+    assets_dir.mkdir()
+
+    result = process_markdown_images(markdown, assets_dir, client=None)
+
+    assert FENCED in result
+    assert f"Code `![x]({site}/images/one.png)` stays." in result
+    assert "![One](assets/" in result
+    assert f"[two]: {site}" not in result and "[two]: assets/" in result
+    assert f'src="{site}' not in result
+    assert len(list(assets_dir.iterdir())) == 4
+
+
+# Image analysis
+
+@pytest.mark.parametrize("batch_size", [1, 2])
+def test_analyze_images_describes_more_images_than_workers(batch_size, tmp_path):
+    paths = []
+    for size in range(4, 10):
+        path = tmp_path / f"image-{size}.png"
+        path.write_bytes(png_bytes(size, size))
+        paths.append(path)
+    client = StubClient()
+
+    descriptions = analyze_images(paths, client, "connection pools", batch_size=batch_size, max_concurrency=2)
+
+    assert len(descriptions) == len(paths)
+    assert all(descriptions)
+    assert client.models.calls == len(paths) // batch_size
+
+
+def test_prepare_images_transcodes_in_worker_processes(tmp_path):
+    pytest.importorskip("PIL")
+    assets_dir = tmp_path / "assets"
+    analysis_dir = tmp_path / "analysis"
+    assets_dir.mkdir()
+    analysis_dir.mkdir()
+    paths = []
+    for size in (40, 50, 60):
+        path = assets_dir / f"image-{size}.png"
+        path.write_bytes(png_bytes(size, size))
+        paths.append(path)
+
+    prepared = prepare_images(paths, analysis_dir, analysis_max_dimension=32, transcode_webp=True, max_workers=2)
+
+    assert [asset.suffix for asset, _ in prepared] == [".webp"] * 3
+    assert all(asset.exists() and analysis.parent == analysis_dir for asset, analysis in prepared)
+
+
+def test_near_duplicates_merge_resized_figures_but_not_flat_icons(tmp_path):
+    Image = pytest.importorskip("PIL.Image")
+    pytest.importorskip("numpy")
+    assets_dir = tmp_path / "assets"
+    assets_dir.mkdir()
+    figure = Image.linear_gradient("L").resize((128, 128)).convert("RGB")
+    figure.save(assets_dir / "figure-large.png")
+    figure.resize((64, 64)).save(assets_dir / "figure-small.png")
+    Image.new("RGB", (32, 32), "red").save(assets_dir / "red-icon.png")
+    Image.new("RGB", (16, 16), "blue").save(assets_dir / "blue-share.png")
+    local_paths = {f"http://example.com/{name}": f"assets/{name}.png"
+                   for name in ("figure-large", "figure-small", "red-icon", "blue-share")}
+
+    collapsed = collapse_near_duplicates(local_paths, assets_dir)
+
+    assert collapsed["http://example.com/figure-small"] == "assets/figure-large.png"
+    assert collapsed["http://example.com/red-icon"] == "assets/red-icon.png"
+    assert collapsed["http://example.com/blue-share"] == "assets/blue-share.png"
+    assert sorted(path.name for path in assets_dir.iterdir()) == ["blue-share.png", "figure-large.png", "red-icon.png"]
+
+
+def test_analyze_images_reuses_cached_descriptions(tmp_path):
+    paths = []
+    for size in range(4, 8):
+        path = tmp_path / f"image-{size}.png"
+        path.write_bytes(png_bytes(size, size))
+        paths.append(path)
+    cache = DescriptionCache(tmp_path / "cache")
+    first, second = StubClient(), StubClient()
+
+    try:
+        described = analyze_images(paths, first, "connection pools", cache=cache)
+        reused = analyze_images(paths, second, "connection pools", cache=cache)
+    finally:
+        cache.close()
+
+    assert first.models.calls == len(paths)
+    assert second.models.calls == 0
+    assert reused == described
+
+
+def test_analyze_images_gives_up_on_images_past_the_deadline(tmp_path):
+    path = tmp_path / "image.png"
+    path.write_bytes(png_bytes())
+    # The analysis cutoff falls 0.7s in, while the stub takes 2s to reply
+    deadline = Deadline(1.5)
+
+    started = time.monotonic()
+    descriptions = analyze_images([path], StubClient(delay=2), "connection pools", deadline=deadline)
+
+    assert descriptions == [None]
+    assert time.monotonic() - started < 1.5
+
+
+def test_convert_webpage_describes_every_image(served, tmp_path):
+    client = StubClient()
+
+    result = convert(f"{served.url}/gallery.html", tmp_path / "out", client=client, engine="local", no_cache=True)
+
+    assert len(result.images) == len(GALLERY_IMAGES)
+    assert all(record["description"] for record in result.images.values())
+    assert result.summary
+    assert result.markdown.count("Image described by call") == len(GALLERY_IMAGES)
+
+
+# Downloads, caches and the Gemini limiter
+
+def test_image_downloads_respect_the_per_host_limit(served, tmp_path):
+    markdown = "".join(f"![Figure]({served.url}/images/{name})\n\n" for name in GALLERY_IMAGES)
+    assets_dir = tmp_path / "assets"
+    assets_dir.mkdir()
+
+    result = process_markdown_images(markdown, assets_dir, client=None, per_host_concurrency=2)
+
+    assert result.count("](assets/") == len(GALLERY_IMAGES)
+    assert served.max_in_flight == 2
+
+
+def test_image_cache_revalidates_instead_of_downloading_again(served, tmp_path):
+    markdown = "".join(f"![Figure]({served.url}/images/{name})\n\n" for name in GALLERY_IMAGES)
+    cache = ImageCache(tmp_path / "cache")
+    outputs = []
+    try:
+        for run in ("first", "second"):
+            assets_dir = tmp_path / run / "assets"
+            assets_dir.mkdir(parents=True)
+            outputs.append(process_markdown_images(markdown, assets_dir, client=None, cache=cache))
+    finally:
+        cache.close()
+
+    statuses = [status for _, status in served.requests]
+    assert statuses == [200] * len(GALLERY_IMAGES) + [304] * len(GALLERY_IMAGES)
+    assert outputs[0] == outputs[1]
+    assert len(list((tmp_path / "second" / "assets").iterdir())) == len(GALLERY_IMAGES)
+
+
+def test_page_cache_keeps_stale_pages_for_offline_and_bounds_entries(tmp_path):
+    cache = PageCache(tmp_path, ttl_seconds=0, max_entries=2)
+    try:
+        for index in range(3):
+            cache.put(f"https://example.com/{index}", f"# Page {index}\n")
+            time.sleep(0.01)
+
+        assert cache.get("https://example.com/2") is None
+        assert cache.get("https://example.com/2", allow_stale=True) == "# Page 2\n"
+        assert cache.get("https://example.com/1", allow_stale=True) == "# Page 1\n"
+        assert cache.get("https://example.com/0", allow_stale=True) is None
+    finally:
+        cache.close()
+
+
+class RateLimited(Exception):
+    code = 429
+
+
+def test_gemini_limiter_bounds_concurrency_and_retries_rate_limits():
+    limiter = GeminiLimiter(rpm=0, tpm=0, max_concurrency=2)
+    counts = {"in_flight": 0, "peak": 0, "calls": 0}
+    lock = threading.Lock()
+
+    def request():
+        with lock:
+            counts["calls"] += 1
+            counts["in_flight"] += 1
+            counts["peak"] = max(counts["peak"], counts["in_flight"])
+            first = counts["calls"] == 1
+        time.sleep(0.05)
+        with lock:
+            counts["in_flight"] -= 1
+        if first:
+            raise RateLimited("429 RESOURCE_EXHAUSTED {'retryDelay': '0.1s'}")
+        return StubResponse("ok")
+
+    threads = [threading.Thread(target=limiter.call, args=(request, 100)) for _ in range(6)]
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+
+    assert counts["peak"] == 2
+    assert counts["calls"] == 7
+    assert limiter.throttled == 1